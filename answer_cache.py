@@ -0,0 +1,145 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Semantic answer cache for repeated quiz requests
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Words that change what a quiz request asks for while barely moving its
+# embedding ("10 easy MCQs on chapter 3" vs "5 hard MCQs on chapter 4")
+_SIGNATURE_WORDS = {
+    "easy", "easier", "simple", "basic", "beginner",
+    "medium", "moderate", "intermediate",
+    "hard", "harder", "difficult", "challenging", "advanced",
+    "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+    "eleven", "twelve", "fifteen", "twenty",
+}
+
+
+def question_signature(question: str) -> Tuple[str, ...]:
+    """
+    The numbers and difficulty words of `question`, in order. A cached answer
+    is only reused for a question with the same signature.
+    """
+    return tuple(
+        word for word in re.findall(r"[a-z]+|\d+", question.lower())
+        if word.isdigit() or word in _SIGNATURE_WORDS
+    )
+
+
+class AnswerCache:
+    """
+    Caches generated answers per (user_id, index version), matched by cosine
+    similarity of the query embedding rather than exact text. A match must
+    also have the same question_signature (numbers, difficulty words).
+
+    Entries expire after `ttl_seconds`; beyond `max_entries` the least
+    recently used are evicted. Query vectors are expected to be normalized
+    (as the BGE embeddings are), so similarity is a dot product.
+    """
+
+    def __init__(self, threshold: float, ttl_seconds: float, max_entries: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # entry_id → (user_id, version, vector, answer, created_at, signature)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # user_id → entry ids, for scanning only that user's entries
+        self._by_user: Dict[str, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, user_id: str, version: Any, vector: List[float], question: str) -> Optional[str]:
+        """
+        Return the cached answer most similar to `vector`, if above threshold,
+        among those for questions with the signature of `question`.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        signature = question_signature(question)
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for entry_id in list(self._by_user.get(user_id, [])):
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                if entry[1] != version or now - entry[4] > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                if entry[5] == signature:
+                    candidates.append(entry_id)
+
+            if candidates:
+                matrix = np.stack([self._entries[i][2] for i in candidates])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry_id = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    logger.info("Answer cache hit for %s (similarity %.3f)", user_id, scores[best])
+                    return self._entries[entry_id][3]
+
+            self.misses += 1
+            return None
+
+    def store(self, user_id: str, version: Any, vector: List[float], question: str, answer: str) -> None:
+        signature = question_signature(question)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (
+                user_id, version, np.asarray(vector, dtype=np.float32), answer, time.time(), signature
+            )
+            self._by_user.setdefault(user_id, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Drop every cached answer for user_id (e.g. after re-ingestion)."""
+        with self._lock:
+            for entry_id in self._by_user.pop(user_id, []):
+                self._entries.pop(entry_id, None)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        ids = self._by_user.get(entry[0])
+        if ids is not None:
+            ids.remove(entry_id)
+            if not ids:
+                del self._by_user[entry[0]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Single shared cache instance
+answer_cache = AnswerCache(
+    threshold=settings.answer_cache_similarity_threshold,
+    ttl_seconds=settings.answer_cache_ttl_seconds,
+    max_entries=settings.answer_cache_max_entries,
+)
@@ -0,0 +1,385 @@
+"""
+Offline benchmark of the ingest and chat hot paths.
+
+Runs with no network: ChatGroq is replaced by a deterministic fake chat
+model, Mongo by the in-memory mongomock backend and the BGE model by a
+hashed bag-of-words embedding (the embedding cache and batcher still wrap
+it, as in production). Vectorstores and the embedding cache live in a
+scratch directory.
+
+For every corpus size (copies of --pdf), ingest throughput is measured,
+then chat turns are run at every concurrency level and timed per stage,
+and retrieval-only search throughput (queries/s) is measured per batch size.
+Peak RSS is read after each phase; it is a process-wide high-water mark,
+so run one corpus size per process for isolated numbers.
+
+    pip install mongomock-motor
+    python benchmark.py --corpus-sizes 1,4,16 --concurrency 1,4,16 --json bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional
+
+# Settings are read at import time and require credentials. Parse workers
+# re-import this module, so nothing else (scratch directory, backends) is
+# set up here; see use_scratch_settings().
+os.environ.setdefault("GROQ_API_KEY", "offline")
+os.environ.setdefault("HUGGINGFACEHUB_API_TOKEN", "")
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import embeddings as embeddings_module
+from chat_history import ChatHistoryManager
+from config import settings
+from ingest import IngestJob, run_ingest
+from semantic_search import search_corpus
+from utils import (
+    CHAT_PIPELINE_MODES,
+    build_or_load_vectorstore,
+    build_rag_chain,
+    build_rag_messages,
+    get_chain_llm,
+)
+from vectorstore_cache import vectorstore_cache
+
+DEFAULT_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test data", "ML.pdf")
+
+QUESTIONS = [
+    "What is supervised learning?",
+    "Explain overfitting and how to avoid it.",
+    "Give me more examples of that.",
+    "How does gradient descent work?",
+    "What is the difference between classification and regression?",
+    "Can you summarize the previous answer?",
+    "Generate three quiz questions about decision trees.",
+    "What are the assumptions of linear regression?",
+]
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Local stand-ins
+# ──────────────────────────────────────────────────────────────────────────────
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic signed feature-hashing of word tokens, L2-normalized."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model: answers with the first `answer_words` words of
+    the prompt after a fixed `latency_ms`, streaming one word per chunk.
+    """
+
+    latency_ms: float = 0.0
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-deterministic"
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        words = " ".join(str(m.content) for m in messages).split()
+        return " ".join(words[: self.answer_words])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ):
+        await asyncio.sleep(self.latency_ms / 1000)
+        for word in self._answer(messages).split():
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def use_scratch_settings(workdir: str) -> None:
+    """Point Mongo, the vectorstores and the embedding cache at offline stand-ins under workdir."""
+    settings.mongo_backend = "mongomock"
+    settings.vectorstore_base_path = os.path.join(workdir, "vectorstores")
+    settings.embedding_cache_path = os.path.join(workdir, "embedding_cache", "embeddings.sqlite3")
+
+
+def install_stand_ins(llm_latency_ms: float, answer_words: int) -> None:
+    llm = FakeChatModel(latency_ms=llm_latency_ms, answer_words=answer_words)
+    embeddings_module.set_llm_factory(lambda: llm)
+    embeddings_module.embeddings.set_factory(lambda: embeddings_module.build_embeddings(HashingEmbeddings()))
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Measurements
+# ──────────────────────────────────────────────────────────────────────────────
+
+def peak_rss_bytes() -> Dict[str, int]:
+    """Peak resident set size of this process and its (parse worker) children."""
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is KiB on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def summarize_ms(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    values = np.asarray(samples)
+    return {
+        "count": len(samples),
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+
+def bench_ingest(user_id: str, pdf_path: str, copies: int, workdir: str) -> Dict[str, Any]:
+    """Ingest `copies` copies of pdf_path for user_id (replace mode)."""
+    upload_dir = tempfile.mkdtemp(dir=workdir)
+    uploads = []
+    for i in range(copies):
+        path = os.path.join(upload_dir, f"doc_{i}.pdf")
+        shutil.copyfile(pdf_path, path)
+        uploads.append((f"doc_{i}.pdf", path))
+
+    vectorstore_cache.clear()
+    job = IngestJob(job_id="benchmark", user_id=user_id, mode="replace")
+    started = time.perf_counter()
+    run_ingest(user_id, uploads, mode="replace", job=job)
+    seconds = time.perf_counter() - started
+    shutil.rmtree(upload_dir, ignore_errors=True)
+
+    pages, chunks = job.pages_parsed, job.chunks_embedded
+    return {
+        "files": copies,
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": round(seconds, 4),
+        "pages_per_second": round(pages / seconds, 2) if seconds else None,
+        "chunks_per_second": round(chunks / seconds, 2) if seconds else None,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+async def chat_turn(user_id: str, chat_id: str, question: str, mode: str) -> Dict[str, float]:
+    """
+    One chat turn through the same steps as POST /rag/chat (answer cache
+    bypassed), timing each stage in milliseconds. "prompt_build" covers
+    question resolution, retrieval and context packing, as done by
+    build_rag_messages.
+    """
+    stages: Dict[str, float] = {}
+
+    def lap(name: str, started: float) -> float:
+        now = time.perf_counter()
+        stages[name] = (now - started) * 1000
+        return now
+
+    t = turn_started = time.perf_counter()
+    history, message_count = await ChatHistoryManager.append_and_load(
+        chat_id, role="human", content=question, window=settings.chat_history_window
+    )
+    t = lap("history_load", t)
+    chain = await asyncio.to_thread(build_rag_chain, user_id, chat_id)
+    t = lap("chain_build", t)
+    messages = await build_rag_messages(chain, question, history[:-1], mode)
+    t = lap("prompt_build", t)
+    result = await get_chain_llm(chain).ainvoke(messages)
+    t = lap("generate", t)
+    await ChatHistoryManager.add_message(chat_id, role="ai", content=result.content)
+    t = lap("history_persist", t)
+    stages["total"] = (t - turn_started) * 1000
+
+    # Runs as a background task in the API, so it is reported but not in "total"
+    await ChatHistoryManager.summarize_if_needed(
+        chat_id, threshold=settings.chat_summary_threshold, message_count=message_count + 1
+    )
+    lap("summarize_background", t)
+    return stages
+
+
+async def bench_chat(user_id: str, concurrency: int, turns: int, mode: str) -> Dict[str, Any]:
+    """Run `turns` chat turns, `concurrency` at a time across as many sessions."""
+    chat_ids = [f"{user_id}-{uuid.uuid4().hex}" for _ in range(concurrency)]
+    for chat_id in chat_ids:
+        await ChatHistoryManager.create_session(chat_id)
+    semaphore = asyncio.Semaphore(concurrency)
+    samples: Dict[str, List[float]] = {}
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            stages = await chat_turn(user_id, chat_ids[i % concurrency], QUESTIONS[i % len(QUESTIONS)], mode)
+        for name, ms in stages.items():
+            samples.setdefault(name, []).append(ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(turns)))
+    seconds = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "turns": turns,
+        "mode": mode,
+        "seconds": round(seconds, 4),
+        "turns_per_second": round(turns / seconds, 2) if seconds else None,
+        "stages_ms": {name: summarize_ms(values) for name, values in samples.items()},
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+async def bench_search(user_id: str, batch_size: int, rounds: int, k: int) -> Dict[str, Any]:
+    """Run `rounds` batched searches of `batch_size` queries, as POST /rag/search does."""
+    vectorstore = await asyncio.to_thread(build_or_load_vectorstore, user_id)
+    queries = [f"{QUESTIONS[i % len(QUESTIONS)]} ({i})" for i in range(batch_size)]
+    samples: List[float] = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = await search_corpus(vectorstore, queries, k)
+        samples.append(result["total_ms"])
+    seconds = time.perf_counter() - started
+    return {
+        "batch_size": batch_size,
+        "rounds": rounds,
+        "k": k,
+        "seconds": round(seconds, 4),
+        "queries_per_second": round(batch_size * rounds / seconds, 1) if seconds else None,
+        "batch_ms": summarize_ms(samples),
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "config": {
+            "corpus_sizes": args.corpus_sizes,
+            "concurrency": args.concurrency,
+            "turns": args.turns,
+            "search_batch_sizes": args.search_batch_sizes,
+            "mode": args.mode,
+            "llm_latency_ms": args.llm_latency_ms,
+            "pdf": args.pdf,
+            "parse_workers": settings.parse_workers,
+            "ingest_embed_batch_size": settings.ingest_embed_batch_size,
+            "faiss_index_type": settings.faiss_index_type,
+        },
+        "started_at": time.time(),
+        "runs": [],
+    }
+    for copies in args.corpus_sizes:
+        user_id = f"bench-{copies}-{uuid.uuid4().hex[:8]}"
+        ingest = await asyncio.to_thread(bench_ingest, user_id, args.pdf, copies, args.workdir)
+        print(
+            f"corpus x{copies}: {ingest['pages']} pages, {ingest['chunks']} chunks in {ingest['seconds']:.2f}s "
+            f"({ingest['pages_per_second']} pages/s, {ingest['chunks_per_second']} chunks/s)"
+        )
+        chats = []
+        for concurrency in args.concurrency:
+            chat = await bench_chat(user_id, concurrency, args.turns, args.mode)
+            total = chat["stages_ms"]["total"]
+            print(
+                f"  concurrency {concurrency:3d}: p50={total['p50']:.1f}ms p95={total['p95']:.1f}ms "
+                f"p99={total['p99']:.1f}ms ({chat['turns_per_second']} turns/s)"
+            )
+            chats.append(chat)
+        searches = []
+        for batch_size in args.search_batch_sizes:
+            search = await bench_search(user_id, batch_size, args.search_rounds, k=5)
+            print(
+                f"  search batch {batch_size:4d}: {search['queries_per_second']} queries/s "
+                f"(p50 batch {search['batch_ms']['p50']:.1f}ms)"
+            )
+            searches.append(search)
+        report["runs"].append({"corpus_copies": copies, "ingest": ingest, "chat": chats, "search": searches})
+    report["peak_rss_bytes"] = peak_rss_bytes()
+    return report
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default=DEFAULT_PDF, help="PDF replicated to build each corpus")
+    parser.add_argument("--corpus-sizes", type=_int_list, default=[1, 4, 16], help="Comma-separated copies of --pdf")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16], help="Comma-separated concurrent turns")
+    parser.add_argument("--turns", type=int, default=64, help="Chat turns per concurrency level")
+    parser.add_argument("--search-batch-sizes", type=_int_list, default=[1, 32, 256],
+                        help="Comma-separated queries per search request")
+    parser.add_argument("--search-rounds", type=int, default=20, help="Search requests per batch size")
+    parser.add_argument("--mode", choices=CHAT_PIPELINE_MODES, default=settings.chat_pipeline_mode)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency of each LLM call")
+    parser.add_argument("--answer-words", type=int, default=60)
+    parser.add_argument("--json", help="Write the full report to this file")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the scratch directory")
+    args = parser.parse_args()
+
+    args.workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    use_scratch_settings(args.workdir)
+    install_stand_ins(args.llm_latency_ms, args.answer_words)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if args.keep_workdir:
+            print(f"Scratch directory kept at {args.workdir}")
+        else:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
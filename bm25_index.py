@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+
+from config import settings
+
+# ──────────────────────────────────────────────────────────────────────────────
+# BM25 inverted index over the chunk store, and hybrid (RRF) retrieval
+#
+# On disk, next to index.faiss (doc ids are chunk/index positions):
+#   bm25_offsets.npy  int64[V + 1]; postings of term t are [off[t], off[t+1])
+#   bm25_doc_ids.npy  int32[P], doc ids of every posting, grouped by term
+#   bm25_weights.npy  float32[P], precomputed BM25 weight of each posting
+#   bm25_vocab.json   terms (by term id) and the BM25 parameters
+#
+# With weights precomputed, scoring a query is a gather over the postings of
+# its terms plus one bincount, with no per-document Python work.
+# ──────────────────────────────────────────────────────────────────────────────
+
+OFFSETS_FILE = "bm25_offsets.npy"
+DOC_IDS_FILE = "bm25_doc_ids.npy"
+WEIGHTS_FILE = "bm25_weights.npy"
+VOCAB_FILE = "bm25_vocab.json"
+
+# Keeps "3.2", "k-means", "f1_score" etc. as single terms
+_TOKEN = re.compile(r"\w+(?:[.\-]\w+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this "
+    "to was were will with what which who how why when where do does can".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def write_bm25_index(folder_path: str, texts: Iterable[str]) -> int:
+    """
+    Build the BM25 postings for `texts` (in index order) and write them,
+    renaming each file into place; returns the vocabulary size.
+    """
+    k1, b = settings.bm25_k1, settings.bm25_b
+    vocab: Dict[str, int] = {}
+    term_ids: List[int] = []
+    doc_ids: List[int] = []
+    tfs: List[int] = []
+    lengths: List[int] = []
+    for doc_id, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            doc_ids.append(doc_id)
+            tfs.append(tf)
+
+    num_docs = len(lengths)
+    dl = np.asarray(lengths, dtype=np.float32)
+    avgdl = float(dl.mean()) if num_docs else 0.0
+    terms = np.asarray(term_ids, dtype=np.int64)
+    docs = np.asarray(doc_ids, dtype=np.int32)
+    tf = np.asarray(tfs, dtype=np.float32)
+
+    df = np.bincount(terms, minlength=len(vocab))
+    idf = np.log1p((num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+    norm = k1 * (1 - b + b * dl[docs] / (avgdl or 1.0)) if num_docs else tf
+    weights = (idf[terms] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+    order = np.argsort(terms, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+
+    def path(name: str) -> str:
+        return os.path.join(folder_path, name)
+
+    for name, array in ((OFFSETS_FILE, offsets), (DOC_IDS_FILE, docs[order]), (WEIGHTS_FILE, weights[order])):
+        with open(path(name + ".tmp"), "wb") as f:
+            np.save(f, array)
+        os.replace(path(name + ".tmp"), path(name))
+
+    # Vocabulary last: its mtime marks a complete index for readers
+    terms_by_id = [""] * len(vocab)
+    for term, i in vocab.items():
+        terms_by_id[i] = term
+    with open(path(VOCAB_FILE + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump({"terms": terms_by_id, "num_docs": num_docs, "avgdl": avgdl, "k1": k1, "b": b}, f)
+    os.replace(path(VOCAB_FILE + ".tmp"), path(VOCAB_FILE))
+    return len(vocab)
+
+
+class BM25Index:
+    """Read-only BM25 index; postings are memory-mapped."""
+
+    def __init__(self, folder_path: str):
+        with open(os.path.join(folder_path, VOCAB_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.vocab = {term: i for i, term in enumerate(meta["terms"])}
+        self.num_docs = meta["num_docs"]
+        self.offsets = np.load(os.path.join(folder_path, OFFSETS_FILE), mmap_mode="r")
+        self.doc_ids = np.load(os.path.join(folder_path, DOC_IDS_FILE), mmap_mode="r")
+        self.weights = np.load(os.path.join(folder_path, WEIGHTS_FILE), mmap_mode="r")
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (doc id, BM25 score) for `query`."""
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids or k <= 0:
+            return []
+        spans = [(int(self.offsets[t]), int(self.offsets[t + 1])) for t in term_ids]
+        docs = np.concatenate([self.doc_ids[s:e] for s, e in spans])
+        weights = np.concatenate([self.weights[s:e] for s, e in spans])
+        unique_docs, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(unique_docs[i]), float(scores[i])) for i in top]
+
+
+_cache: "OrderedDict[Tuple[str, int], BM25Index]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_bm25_index(folder_path: str) -> Optional[BM25Index]:
+    """
+    The BM25 index saved in `folder_path` (None if it has none), cached per
+    folder and file version so the vocabulary is parsed once per save.
+    """
+    try:
+        version = os.stat(os.path.join(folder_path, VOCAB_FILE)).st_mtime_ns
+    except OSError:
+        return None
+    key = (folder_path, version)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None:
+            _cache.move_to_end(key)
+            return index
+    index = BM25Index(folder_path)
+    with _cache_lock:
+        for stale in [k for k in _cache if k[0] == folder_path]:
+            del _cache[stale]
+        _cache[key] = index
+        while len(_cache) > settings.vectorstore_cache_max_entries:
+            _cache.popitem(last=False)
+    return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], rrf_k: int) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists: score(d) = Σ 1 / (rrf_k + rank of d), rank starting at 1."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_search(
+    vectorstore: FAISS,
+    lexical: Optional[BM25Index],
+    query: str,
+    query_vector: List[float],
+    k: int,
+) -> List[Tuple[int, float]]:
+    """
+    Top-k index positions for `query`, fusing the FAISS ranking with the
+    BM25 ranking (when a lexical index is given) by reciprocal rank.
+    Scores are normalized so the best hit is 1.0.
+    """
+    depth = max(k, settings.hybrid_candidates)
+    _, ids = vectorstore.index.search(np.asarray([query_vector], dtype=np.float32), depth)
+    rankings = [[int(i) for i in ids[0] if i >= 0]]
+    if lexical is not None:
+        rankings.append([doc_id for doc_id, _ in lexical.search(query, depth)])
+    fused = reciprocal_rank_fusion(rankings, settings.hybrid_rrf_k)[:k]
+    if not fused:
+        return []
+    best = fused[0][1]
+    return [(doc_id, score / best) for doc_id, score in fused]
+
+
+def hybrid_documents(
+    vectorstore: FAISS,
+    lexical: Optional[BM25Index],
+    query: str,
+    query_vector: List[float],
+    k: int,
+) -> List[Document]:
+    docs = []
+    for position, _ in hybrid_search(vectorstore, lexical, query, query_vector, k):
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[position])
+        if isinstance(doc, Document):
+            docs.append(doc)
+    return docs
+
+
+class HybridRetriever(VectorStoreRetriever):
+    """
+    Retriever over a FAISS vectorstore that fuses vector and BM25 rankings
+    (see hybrid_search). Without a lexical index it is plain vector search.
+    """
+
+    lexical_index: Any = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: Any = None, **kwargs: Any) -> List[Document]:
+        vector = self.vectorstore.embedding_function.embed_query(query)
+        return hybrid_documents(self.vectorstore, self.lexical_index, query, vector, self.search_kwargs.get("k", 4))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: Any = None, **kwargs: Any) -> List[Document]:
+        vector = await self.vectorstore.embedding_function.aembed_query(query)
+        return await asyncio.to_thread(
+            hybrid_documents, self.vectorstore, self.lexical_index, query, vector, self.search_kwargs.get("k", 4)
+        )
@@ -0,0 +1,84 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+from langchain_community.vectorstores import FAISS
+
+from config import settings
+from embeddings import embeddings, get_llm, user_prompt
+from faiss_index import search_many
+from logging_config import logger
+from metrics import span
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Bulk quiz generation: one batched retrieval, bounded concurrent generation
+# ──────────────────────────────────────────────────────────────────────────────
+
+def quiz_request_text(spec: Any) -> str:
+    """Phrase a quiz spec as the user requirements expected by user_prompt."""
+    return (
+        f"Create a quiz on {spec.topic}. Quiz type should be {spec.quiz_type}, "
+        f"complexity should be {spec.difficulty} and total number of questions "
+        f"should be {spec.num_questions}."
+    )
+
+
+async def _generate_one(index: int, spec: Any, hits: List, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    result: Dict[str, Any] = {
+        "index": index,
+        "topic": spec.topic,
+        "quiz_type": spec.quiz_type,
+        "difficulty": spec.difficulty,
+        "num_questions": spec.num_questions,
+        "success": False,
+        "quiz": None,
+        "error": None,
+        "sources": sorted({doc.metadata.get("source") for doc, _ in hits if doc.metadata.get("source")}),
+    }
+    if not hits:
+        result["error"] = "No relevant context found for this topic."
+        return result
+
+    context = "\n\n".join(doc.page_content for doc, _ in hits)
+    messages = user_prompt.format_messages(context=context, question=quiz_request_text(spec))
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            with span("quiz.generate"):
+                response = await get_llm().ainvoke(messages)
+            result["quiz"] = getattr(response, "content", response)
+            result["success"] = True
+        except Exception as e:
+            logger.error("Bulk quiz item %d (%s) failed: %s", index, spec.topic, e, exc_info=True)
+            result["error"] = str(e)
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+async def generate_quizzes(vectorstore: FAISS, specs: List[Any], k: int) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Generate one quiz per spec (topic, quiz_type, difficulty, num_questions)
+    from `vectorstore`, yielding each result as soon as it completes.
+
+    All topics are embedded in one batch and retrieved with one matrix
+    search; generation then runs at most bulk_quiz_concurrency LLM calls at
+    a time. A failed item is yielded with `success: false` and its `error`,
+    without affecting the others.
+    """
+    with span("quiz.embed_topics"):
+        vectors = await embeddings.aembed_queries([spec.topic for spec in specs])
+    with span("quiz.retrieve"):
+        hits = await asyncio.to_thread(search_many, vectorstore, vectors, k)
+
+    semaphore = asyncio.Semaphore(settings.bulk_quiz_concurrency)
+    tasks = [
+        asyncio.create_task(_generate_one(i, spec, item_hits, semaphore))
+        for i, (spec, item_hits) in enumerate(zip(specs, hits))
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stop outstanding generations if the client went away
+        for task in tasks:
+            task.cancel()
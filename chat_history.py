@@ -1,90 +1,188 @@
 import time
-from typing import List, Dict, Any
+import uuid
+from typing import List, Dict, Any, Optional, Tuple
 from pymongo import ReturnDocument
 
 from config import settings
-from db import mongo_client, chat_collection_name
+from db import get_chat_collection
 from embeddings import get_llm
 from langchain.prompts import ChatPromptTemplate
 from logging_config import logger
+from metrics import span
 
-# Get the actual collection object
-db = mongo_client[settings.mongo_chat_db]
-coll = db[chat_collection_name]
-
-# LLM & summarization prompt
-llm = get_llm()
+# Summarization prompt (run on the shared LLM client from get_llm())
 summarization_prompt = ChatPromptTemplate.from_messages([
-    ("system", "Summarize the following conversation into a concise summary:"),
-    ("human", "{chat_history}")
+    ("system", "Update the running summary of a conversation with the new messages. "
+               "Return a single concise summary covering both."),
+    ("human", "Current summary:\n{summary}\n\nNew messages:\n{chat_history}")
 ])
 
 class ChatHistoryManager:
+    """
+    Chat sessions are stored as one document per chat_id:
+      - messages:      the most recent raw {type, content, timestamp} entries
+      - message_count: len(messages), maintained alongside every push/pull
+      - summary:       rolling summary of every message already pulled out of `messages`
+    """
+
     @staticmethod
-    def create_session(chat_id: str) -> None:
+    async def create_session(chat_id: str) -> None:
         """Ensure a document exists for this chat_id with empty messages."""
-        coll.update_one(
-            {"session_id": chat_id},
-            {"$setOnInsert": {"session_id": chat_id, "messages": []}},
-            upsert=True
-        )
+        with span("chat.session_create"):
+            await get_chat_collection().update_one(
+                {"session_id": chat_id},
+                {"$setOnInsert": {"session_id": chat_id, "messages": [], "message_count": 0}},
+                upsert=True
+            )
         logger.info("Initialized chat session %s", chat_id)
 
     @staticmethod
-    def get_messages(chat_id: str) -> List[Dict[str, Any]]:
+    async def append_and_load(
+        chat_id: str,
+        role: str,
+        content: str,
+        window: int,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        In one atomic operation: create the session if missing, append a
+        {role,content,timestamp} entry and return the last `window` messages
+        (including the new one) along with the session's raw message count.
+        If the session has a rolling summary it is returned first, as an
+        "ai" message.
+        """
+        entry = {
+            "type": role,
+            "content": content,
+            "timestamp": time.time()
+        }
+        with span("chat.history_load"):
+            doc = await get_chat_collection().find_one_and_update(
+                {"session_id": chat_id},
+                {"$push": {"messages": entry}, "$inc": {"message_count": 1}},
+                projection={"_id": 0, "messages": {"$slice": -window}, "message_count": 1, "summary": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        logger.debug("Appended %s message to %s", role, chat_id)
+        messages = doc.get("messages", [])
+        if doc.get("summary"):
+            messages = [{"type": "ai", "content": doc["summary"]}] + messages
+        return messages, doc.get("message_count", 0)
+
+    @staticmethod
+    async def get_messages(chat_id: str) -> List[Dict[str, Any]]:
         """Return the messages array for this session (or empty if none)."""
-        doc = coll.find_one({"session_id": chat_id}, {"_id": 0, "messages": 1})
+        doc = await get_chat_collection().find_one({"session_id": chat_id}, {"_id": 0, "messages": 1})
         return doc.get("messages", []) if doc else []
 
     @staticmethod
-    def add_message(chat_id: str, role: str, content: str) -> None:
+    async def add_message(chat_id: str, role: str, content: str) -> None:
         """Append a new {role,content,timestamp} entry to the messages array."""
         entry = {
             "type": role,
             "content": content,
             "timestamp": time.time()
         }
-        coll.update_one(
-            {"session_id": chat_id},
-            {"$push": {"messages": entry}}
-        )
+        with span("chat.persist"):
+            await get_chat_collection().update_one(
+                {"session_id": chat_id},
+                {"$push": {"messages": entry}, "$inc": {"message_count": 1}}
+            )
         logger.debug("Appended %s message to %s", role, chat_id)
 
     @staticmethod
-    def summarize_if_needed(chat_id: str, threshold: int = 10) -> bool:
+    async def summarize_if_needed(
+        chat_id: str,
+        threshold: int = 10,
+        message_count: Optional[int] = None,
+        keep_recent: Optional[int] = None,
+    ) -> bool:
         """
-        If message count > threshold, summarize and replace all messages
-        with a single "ai" summary entry.
+        If more than `threshold` raw messages are stored, fold all but the
+        last `keep_recent` into the rolling summary and remove them.
+
+        Only the overflowed messages are sent to the LLM, together with the
+        previous summary. A lease on the session document ensures that two
+        turns (in any worker) never summarize the same chat concurrently;
+        a caller that cannot take the lease simply skips. Pass a known
+        `message_count` to skip reading the session when under threshold.
+        Meant to run in the background, after the response has been sent.
         """
-        messages = ChatHistoryManager.get_messages(chat_id)
-        if len(messages) <= threshold:
+        if message_count is not None and message_count <= threshold:
             return False
+        if keep_recent is None:
+            keep_recent = settings.chat_summary_keep_recent
 
-        # Flatten for summarization
-        chat_text = "\n".join(f"{m['type'].upper()}: {m['content']}" for m in messages)
-
-        # Run summarization
-        summary_chain = summarization_prompt | llm
-        result = summary_chain.invoke({"chat_history": chat_text})
-        summary = getattr(result, "content", result)
-
-        # Replace entire messages array with the summary
-        coll.find_one_and_update(
-            {"session_id": chat_id},
-            {"$set": {"messages": [
-                {"type": "ai", "content": summary, "timestamp": time.time()}
-            ]}},
+        coll = get_chat_collection()
+        now = time.time()
+        # Unique per attempt, so only the holder of the lease can release it
+        lease = uuid.uuid4().hex
+        doc = await coll.find_one_and_update(
+            {
+                "session_id": chat_id,
+                "$or": [
+                    {"summarizing_until": {"$exists": False}},
+                    {"summarizing_until": {"$lt": now}},
+                ],
+            },
+            {"$set": {"summarizing_until": now + settings.chat_summary_lease_seconds, "summarizing_lease": lease}},
+            # (no "_id": 0 here: mongomock returns None for that projection)
+            projection={"messages": 1, "summary": 1},
             return_document=ReturnDocument.AFTER
         )
-        logger.info("Summarized chat %s down to one message", chat_id)
-        return True
+        if doc is None:
+            logger.debug("Summarization already running for %s", chat_id)
+            return False
+
+        try:
+            messages = doc.get("messages", [])
+            if len(messages) <= threshold:
+                return False
+            overflow = messages[:len(messages) - keep_recent]
+
+            # Flatten only the newly overflowed messages for summarization
+            chat_text = "\n".join(f"{m['type'].upper()}: {m['content']}" for m in overflow)
+
+            with span("chat.summarize"):
+                # Run summarization
+                summary_chain = summarization_prompt | get_llm()
+                result = await summary_chain.ainvoke({
+                    "summary": doc.get("summary") or "(none)",
+                    "chat_history": chat_text,
+                })
+                summary = getattr(result, "content", result)
+
+                # Store the new summary and drop exactly the summarized entries
+                # (matched as whole documents), unless the lease was lost meanwhile
+                result = await coll.update_one(
+                    {"session_id": chat_id, "summarizing_lease": lease},
+                    {
+                        "$set": {"summary": summary},
+                        "$pull": {"messages": {"$in": overflow}},
+                    }
+                )
+                if result.matched_count == 0:
+                    logger.warning("Summarization lease for %s expired; discarding summary", chat_id)
+                    return False
+                # Recount from the array itself, so appends made meanwhile are counted too
+                await coll.update_one(
+                    {"session_id": chat_id},
+                    [{"$set": {"message_count": {"$size": "$messages"}}}],
+                )
+            logger.info("Folded %d messages of chat %s into its summary", len(overflow), chat_id)
+            return True
+        finally:
+            await coll.update_one(
+                {"session_id": chat_id, "summarizing_lease": lease},
+                {"$unset": {"summarizing_until": "", "summarizing_lease": ""}},
+            )
 
     @staticmethod
-    def get_retrieved_context(chat_id: str) -> str:
+    async def get_retrieved_context(chat_id: str) -> str:
         """
         Return concatenated human messages from chat history for context retrieval.
         """
-        messages = ChatHistoryManager.get_messages(chat_id)
+        messages = await ChatHistoryManager.get_messages(chat_id)
         context = "\n".join([
             m["content"] for m in messages
             if m["type"] == "human" or m["type"] == "user"
@@ -0,0 +1,198 @@
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterator, List, Set, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Memory-mapped chunk store (replaces the pickled LangChain docstore)
+#
+# On disk, next to index.faiss:
+#   chunks.bin             contiguous UTF-8 text of every chunk, in index order
+#   chunk_offsets.npy      int64[n + 1]; chunk i is chunks.bin[off[i]:off[i+1]]
+#   chunk_meta.bin         contiguous UTF-8 JSON metadata of every chunk
+#   chunk_meta_offsets.npy int64[n + 1], same layout for chunk_meta.bin
+#
+# Chunk ids are their index positions ("0", "1", ...), so nothing has to be
+# deserialized on load; a chunk's bytes are only touched when it is read.
+# ──────────────────────────────────────────────────────────────────────────────
+
+TEXT_FILE = "chunks.bin"
+TEXT_OFFSETS_FILE = "chunk_offsets.npy"
+META_FILE = "chunk_meta.bin"
+META_OFFSETS_FILE = "chunk_meta_offsets.npy"
+
+
+def has_chunk_store(folder_path: str) -> bool:
+    return os.path.isfile(os.path.join(folder_path, TEXT_OFFSETS_FILE))
+
+
+class _Blob:
+    """Read-only view of a blob file plus its offsets array, both memory-mapped."""
+
+    def __init__(self, blob_path: str, offsets_path: str):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(blob_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def close(self) -> None:
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def get(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self._map[start:end].decode("utf-8")
+
+
+class MmapChunkStore(Docstore, AddableMixin):
+    """
+    Docstore over the memory-mapped chunk files. Chunks added after loading
+    (e.g. by FAISS.add_embeddings while appending) are kept in memory, and
+    deleted chunks are tombstoned, until the store is written out again.
+    """
+
+    def __init__(self, folder_path: str):
+        self._texts = _Blob(os.path.join(folder_path, TEXT_FILE), os.path.join(folder_path, TEXT_OFFSETS_FILE))
+        self._metas = _Blob(os.path.join(folder_path, META_FILE), os.path.join(folder_path, META_OFFSETS_FILE))
+        self._added: Dict[str, Document] = {}
+        self._deleted: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._texts) + len(self._added) - len(self._deleted)
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._deleted:
+            return f"ID {search} not found."
+        doc = self._added.get(search)
+        if doc is not None:
+            return doc
+        try:
+            i = int(search)
+        except ValueError:
+            return f"ID {search} not found."
+        if not 0 <= i < len(self._texts):
+            return f"ID {search} not found."
+        return Document(page_content=self._texts.get(i), metadata=json.loads(self._metas.get(i)))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = set(texts).intersection(self._added)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+
+    def delete(self, ids: List) -> None:
+        """
+        Delete chunks by id. Stored chunks are tombstoned; FAISS.delete
+        renumbers index_to_docstore_id, so the next write_chunk_store drops
+        them and stores the rest under their new positions.
+        """
+        missing = [i for i in ids if not isinstance(self.search(i), Document)]
+        if missing:
+            raise ValueError(f"Tried to delete ids that do not exist: {missing}")
+        for i in ids:
+            if self._added.pop(i, None) is None:
+                self._deleted.add(i)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory held by the store: both offsets tables plus chunks
+        added since loading. The mapped text is paged in on demand and shared
+        through the page cache, so it is not counted.
+        """
+        size = self._texts.offsets.nbytes + self._metas.offsets.nbytes
+        for doc in self._added.values():
+            size += len(doc.page_content.encode("utf-8"))
+        return size
+
+    def close(self) -> None:
+        """Release the file handles and mappings; the store must not be used afterwards."""
+        self._texts.close()
+        self._metas.close()
+
+
+class PositionalIds(dict):
+    """
+    index_to_docstore_id for a MmapChunkStore: positions below `base` map to
+    str(position) without materializing a dict entry each; positions added
+    later are stored normally.
+    """
+
+    def __init__(self, base: int):
+        super().__init__()
+        self.base = base
+
+    def __getitem__(self, i: int) -> str:
+        if 0 <= i < self.base:
+            return str(i)
+        return super().__getitem__(i)
+
+    def get(self, i: int, default: Any = None) -> Any:
+        try:
+            return self[i]
+        except KeyError:
+            return default
+
+    def __contains__(self, i: object) -> bool:
+        return (isinstance(i, int) and 0 <= i < self.base) or super().__contains__(i)
+
+    def __len__(self) -> int:
+        return self.base + super().__len__()
+
+    def __iter__(self) -> Iterator[int]:
+        yield from range(self.base)
+        yield from super().__iter__()
+
+    def keys(self):
+        return list(iter(self))
+
+    def values(self):
+        return [self[i] for i in self]
+
+    def items(self):
+        return [(i, self[i]) for i in self]
+
+
+def iter_documents(docstore: Docstore, index_to_docstore_id: Dict[int, str], ntotal: int) -> Iterator[Document]:
+    for i in range(ntotal):
+        doc = docstore.search(index_to_docstore_id[i])
+        if not isinstance(doc, Document):
+            raise ValueError(f"Chunk {i} missing from docstore: {doc}")
+        yield doc
+
+
+def write_chunk_store(folder_path: str, documents: Iterator[Document]) -> int:
+    """
+    Write `documents` (in index order) as chunk store files; returns the count.
+    Files are written under temporary names and renamed into place, so a
+    store that is currently memory-mapped from this folder stays readable.
+    """
+    def path(name: str) -> str:
+        return os.path.join(folder_path, name)
+
+    text_offsets: List[int] = [0]
+    meta_offsets: List[int] = [0]
+    with open(path(TEXT_FILE + ".tmp"), "wb") as texts, open(path(META_FILE + ".tmp"), "wb") as metas:
+        for doc in documents:
+            text_offsets.append(text_offsets[-1] + texts.write(doc.page_content.encode("utf-8")))
+            meta_offsets.append(meta_offsets[-1] + metas.write(json.dumps(doc.metadata).encode("utf-8")))
+    for name, offsets in ((TEXT_OFFSETS_FILE, text_offsets), (META_OFFSETS_FILE, meta_offsets)):
+        with open(path(name + ".tmp"), "wb") as f:
+            np.save(f, np.asarray(offsets, dtype=np.int64))
+
+    for name in (TEXT_FILE, META_FILE, TEXT_OFFSETS_FILE, META_OFFSETS_FILE):
+        os.replace(path(name + ".tmp"), path(name))
+    return len(text_offsets) - 1
+
+
+def load_chunk_store(folder_path: str) -> Tuple[MmapChunkStore, PositionalIds]:
+    store = MmapChunkStore(folder_path)
+    return store, PositionalIds(len(store))
@@ -0,0 +1,126 @@
+"""
+Compare recall and latency of FAISS index types on the stored user indexes.
+
+For every user's published ./vectorstores/{user_id} index (or the users given
+with --user), the stored vectors are used to build each candidate index type;
+queries are stored vectors with a little noise, and exact flat search over
+the same vectors is the ground truth.
+
+    python compare_indexes.py --k 5 --queries 200 --json index_report.json
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+import faiss
+import numpy as np
+
+from config import settings
+from faiss_index import (
+    INDEX_TYPES,
+    build_index,
+    configure_search_params,
+    index_type_of,
+    read_index_meta,
+    reconstruct_vectors,
+)
+from index_store import current_index_dir
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def evaluate(index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    _, batch_ids = index.search(queries, k)
+    batch_seconds = time.perf_counter() - started
+
+    single = []
+    for q in queries:
+        started = time.perf_counter()
+        index.search(q[None, :], k)
+        single.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "recall_at_k": round(recall_at_k(batch_ids, truth), 4),
+        "batch_qps": round(len(queries) / batch_seconds, 1) if batch_seconds else None,
+        "single_query_p50_ms": round(float(np.percentile(single, 50)), 4),
+        "single_query_p95_ms": round(float(np.percentile(single, 95)), 4),
+        "size_bytes": int(faiss.serialize_index(index).nbytes),
+    }
+
+
+def compare_user(folder: str, types: List[str], k: int, num_queries: int, seed: int) -> Dict[str, Any]:
+    stored = faiss.read_index(os.path.join(folder, "index.faiss"))
+    configure_search_params(stored)
+    vectors = np.ascontiguousarray(reconstruct_vectors(stored), dtype=np.float32)
+    n = len(vectors)
+    k = min(k, n)
+
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(n, size=min(num_queries, n), replace=False)
+    queries = vectors[picks] + rng.normal(0, 0.05, size=(len(picks), vectors.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    report: Dict[str, Any] = {
+        "ntotal": n,
+        "dim": int(vectors.shape[1]),
+        "stored": {"index_type": index_type_of(stored), "meta": read_index_meta(folder),
+                   **evaluate(stored, queries, truth, k)},
+        "candidates": {},
+    }
+    for index_type in types:
+        started = time.perf_counter()
+        index, factory = build_index(vectors, index_type)
+        build_seconds = time.perf_counter() - started
+        report["candidates"][index_type] = {
+            "factory": factory,
+            "build_seconds": round(build_seconds, 4),
+            **evaluate(index, queries, truth, k),
+        }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-path", default=settings.vectorstore_base_path)
+    parser.add_argument("--user", action="append", help="Only these user_ids (repeatable)")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args()
+
+    types = [t.strip() for t in args.types.split(",") if t.strip()]
+    users = args.user or sorted(os.listdir(args.base_path))
+
+    report = {}
+    for user_id in users:
+        folder = current_index_dir(os.path.join(args.base_path, user_id))
+        if folder is None or not os.path.isfile(os.path.join(folder, "index.faiss")):
+            continue
+        report[user_id] = result = compare_user(folder, types, args.k, args.queries, args.seed)
+        print(f"{user_id}: {result['ntotal']} vectors, stored as {result['stored']['index_type']}")
+        for name, row in [("stored", result["stored"]), *result["candidates"].items()]:
+            print(
+                f"  {name:8s} recall@{args.k}={row['recall_at_k']:.3f} "
+                f"p50={row['single_query_p50_ms']:.3f}ms p95={row['single_query_p95_ms']:.3f}ms "
+                f"size={row['size_bytes'] / 1024:.0f}KiB"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
+import multiprocessing
+import os
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -9,6 +13,68 @@ class Settings(BaseSettings):
     groq_api_key: str
     vectorstore_base_path: str = "./vectorstores"
 
+    # Shared LLM client. LLM_BASE_URL overrides the Groq endpoint (e.g. a
+    # local fake server); limits apply across all chat/quiz/summary calls.
+    llm_model: str = "meta-llama/llama-4-scout-17b-16e-instruct"
+    llm_base_url: Optional[str] = None
+    llm_timeout_seconds: float = 60.0
+    llm_max_concurrency: int = 16
+    llm_max_concurrency_per_user: int = 4
+    # Local token bucket in requests/minute (0: only follow provider quota headers)
+    llm_rate_limit_rpm: float = 0
+    # Pause when the provider reports fewer tokens than this left in its window
+    llm_min_remaining_tokens: int = 2000
+    llm_max_retries: int = 3
+    llm_retry_base_delay_seconds: float = 0.5
+    llm_retry_max_delay_seconds: float = 20.0
+    # Send a duplicate request if the first has not answered after this long (0 disables)
+    llm_hedge_after_ms: float = 0
+
+    # In-process LRU cache of loaded per-user vectorstores
+    vectorstore_cache_max_entries: int = 32
+    vectorstore_cache_max_bytes: int = 1024 * 1024 * 1024
+    # Evicted/replaced vectorstores are closed after this long (in-flight searches finish first)
+    vectorstore_close_grace_seconds: float = 60.0
+
+    # FAISS index type: "auto" (by chunk count), "flat", "hnsw", "ivf", "sq8" or "ivfpq"
+    faiss_index_type: str = "auto"
+    faiss_auto_hnsw_min_vectors: int = 20_000
+    faiss_auto_ivf_min_vectors: int = 200_000
+    faiss_hnsw_m: int = 32
+    faiss_hnsw_ef_search: int = 64
+    faiss_ivf_nprobe: int = 16
+
+    # Older index versions kept after publishing a new one (workers still
+    # serving them pick up the new generation on their next request)
+    index_versions_retained: int = 2
+
+    # Memory-map saved indexes read-only on load (shared via the OS page cache)
+    faiss_mmap: bool = True
+
+    # Persistent embedding cache (content-addressed by chunk text)
+    embedding_cache_enabled: bool = True
+    embedding_cache_path: str = "./embedding_cache/embeddings.sqlite3"
+    embedding_cache_max_entries: int = 500_000
+
+    # Micro-batching of concurrent embedding calls
+    embedding_batching_enabled: bool = True
+    embedding_batch_max_size: int = 32
+    embedding_batch_max_wait_ms: float = 5.0
+
+    # Ingestion workers and job queue
+    ingest_workers: int = 2
+    ingest_queue_size: int = 16
+    ingest_job_retention: int = 1000
+    ingest_embed_batch_size: int = 64
+
+    # Document parsing process pool (0 parses in the ingest worker itself)
+    parse_workers: int = max(1, (os.cpu_count() or 2) - 1)
+    parse_pages_per_task: int = 16
+    # "forkserver" or "spawn"; "fork" is unsafe in the multi-threaded server
+    parse_start_method: str = (
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    )
+
     # ───────────────────────────────────────────────────────────────────────────
     # Hugging Face Hub
     # ───────────────────────────────────────────────────────────────────────────
@@ -21,6 +87,72 @@ class Settings(BaseSettings):
     mongo_chat_db: str = "QuizAI"
     mongo_chat_collection: str = "chat_histories"
 
+    # Number of recent messages loaded into the chain on each chat turn
+    chat_history_window: int = 20
+
+    # Rolling summarization: once more than `threshold` raw messages are stored,
+    # all but the last `keep_recent` are folded into the session summary
+    chat_summary_threshold: int = 10
+    chat_summary_keep_recent: int = 4
+    chat_summary_lease_seconds: int = 120
+
+    # How a chat turn resolves follow-up questions before retrieval:
+    #   "condense"  – extra LLM call rewriting the question against history
+    #   "heuristic" – local follow-up detection, single LLM call
+    #   "raw"       – retrieve with the question as-is, single LLM call
+    chat_pipeline_mode: str = "condense"
+
+    # Hybrid retrieval: BM25 index built at ingest, fused with vector search
+    # by reciprocal rank (score = sum of 1 / (rrf_k + rank))
+    hybrid_retrieval_enabled: bool = True
+    hybrid_candidates: int = 20
+    hybrid_rrf_k: int = 60
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+
+    # Context packing: fetch `fetch_k` candidates, pick by MMR (skipping
+    # near-duplicates), merge adjacent chunks and stop at the token budget
+    context_packing_enabled: bool = True
+    context_token_budget: int = 600
+    context_fetch_k: int = 20
+    context_mmr_lambda: float = 0.7
+    context_duplicate_threshold: float = 0.92
+
+    # Semantic answer cache, keyed by user, index version and query embedding
+    answer_cache_enabled: bool = True
+    answer_cache_similarity_threshold: float = 0.95
+    answer_cache_ttl_seconds: int = 3600
+    answer_cache_max_entries: int = 10_000
+
+    # Course recommendations: memoized per (course, score band)
+    recommendation_marks_band: int = 10
+    recommendation_ttl_seconds: int = 24 * 3600
+    recommendation_cache_max_entries: int = 10_000
+    recommendation_batch_concurrency: int = 8
+
+    # Bulk quiz generation: max items per request and concurrent LLM calls
+    bulk_quiz_max_items: int = 100
+    bulk_quiz_concurrency: int = 4
+
+    # Retrieval-only search: max queries per request
+    search_max_queries: int = 1000
+
+    # Question bank generated in the background after each ingest (costs one
+    # LLM call per new section), then sampled by /rag/quiz/bank without the LLM
+    question_bank_enabled: bool = False
+    question_bank_section_chars: int = 4000
+    question_bank_questions_per_level: int = 2
+    question_bank_concurrency: int = 2
+    question_bank_sample_pool_factor: int = 3
+
+    # "motor" for a real server, "mongomock" for an in-memory stand-in (tests/benchmarks)
+    mongo_backend: str = "motor"
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_server_selection_timeout_ms: int = 5000
+    mongo_connect_timeout_ms: int = 5000
+    mongo_socket_timeout_ms: int = 20000
+
     # ───────────────────────────────────────────────────────────────────────────
     # FastAPI Server Configuration
     # ───────────────────────────────────────────────────────────────────────────
@@ -28,6 +160,16 @@ class Settings(BaseSettings):
     port: int = 8000
     debug: bool = False
 
+    # Metrics: samples kept per stage for percentiles, optional Server-Timing
+    # response headers, and how often event-loop lag is sampled (0 disables)
+    metrics_window: int = 1024
+    metrics_timing_headers: bool = False
+    event_loop_lag_interval_seconds: float = 0.5
+
+    # Load the embedding model and connect to Mongo in the startup hook;
+    # when False they are created lazily on first use
+    warmup_on_startup: bool = True
+
     # ───────────────────────────────────────────────────────────────────────────
     # App Metadata (unchanged)
     # ───────────────────────────────────────────────────────────────────────────
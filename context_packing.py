@@ -0,0 +1,215 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index, hybrid_search
+from config import settings
+from embeddings import embeddings
+from metrics import metrics, span
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Context packing between retrieval and generation
+#
+# Instead of stuffing the top-k chunks as they are, fetch more candidates,
+# pick them by MMR (relevance minus redundancy with what is already picked,
+# skipping near-duplicates), stop at a token budget, and merge chunks that
+# were adjacent in the source so their shared overlap is sent only once.
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Overlaps shorter than this are treated as coincidence rather than splitter overlap
+_MIN_OVERLAP_CHARS = 20
+_MAX_OVERLAP_CHARS = 400
+
+
+@dataclass
+class Candidate:
+    position: int
+    document: Document
+    relevance: float
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate prompt tokens of `text` (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def text_overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of `first` that starts `second`, if long enough to be splitter overlap."""
+    for k in range(min(len(first), len(second), _MAX_OVERLAP_CHARS), _MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:k]):
+            return k
+    return 0
+
+
+def fetch_candidates(
+    vectorstore: FAISS,
+    query_vector: List[float],
+    fetch_k: int,
+    query: str = "",
+    lexical: Optional[BM25Index] = None,
+) -> Tuple[List[Candidate], Optional[np.ndarray]]:
+    """
+    Top `fetch_k` chunks for the query, plus their stored vectors when the
+    index can reconstruct them. Relevance is cosine similarity (embeddings
+    are normalized, so squared L2 d gives cos = 1 - d / 2), or the
+    normalized fused score when a lexical index is given (hybrid search).
+    """
+    if lexical is not None:
+        ranked = hybrid_search(vectorstore, lexical, query, query_vector, fetch_k)
+    else:
+        distances, ids = vectorstore.index.search(np.asarray([query_vector], dtype=np.float32), fetch_k)
+        ranked = [(int(i), 1.0 - float(d) / 2) for d, i in zip(distances[0], ids[0]) if i >= 0]
+    candidates = []
+    for position, relevance in ranked:
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[position])
+        if isinstance(doc, Document):
+            candidates.append(Candidate(position, doc, relevance))
+
+    vectors = None
+    try:
+        vectors = np.vstack([vectorstore.index.reconstruct(c.position) for c in candidates]) if candidates else None
+    except RuntimeError:
+        pass  # e.g. IVF without a direct map: fall back to lexical similarity
+    return candidates, vectors
+
+
+def similarity_matrix(candidates: List[Candidate], vectors: Optional[np.ndarray]) -> np.ndarray:
+    """Pairwise similarity of candidates: cosine of vectors, else word-set Jaccard."""
+    if vectors is not None:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        unit = vectors / np.where(norms == 0, 1, norms)
+        return unit @ unit.T
+    words = [set(c.document.page_content.lower().split()) for c in candidates]
+    n = len(candidates)
+    sims = np.eye(n, dtype=np.float32)
+    for i in range(n):
+        for j in range(i + 1, n):
+            union = len(words[i] | words[j])
+            sims[i, j] = sims[j, i] = len(words[i] & words[j]) / union if union else 0.0
+    return sims
+
+
+def _adjacent(a: Candidate, b: Candidate) -> bool:
+    return abs(a.position - b.position) == 1 and a.document.metadata.get("source") == b.document.metadata.get("source")
+
+
+def select_mmr(
+    candidates: List[Candidate],
+    sims: np.ndarray,
+    budget_tokens: int,
+    mmr_lambda: float,
+    duplicate_threshold: float,
+) -> Tuple[List[Candidate], int]:
+    """
+    Greedy MMR selection under a token budget. A candidate adjacent to an
+    already selected chunk only costs the text beyond their overlap.
+    Returns (selected, number of near-duplicates skipped).
+    """
+    selected: List[int] = []
+    remaining = list(range(len(candidates)))
+    used = duplicates = 0
+    while remaining and used < budget_tokens:
+        redundancy = {i: max((sims[i, j] for j in selected), default=0.0) for i in remaining}
+        best = max(remaining, key=lambda i: mmr_lambda * candidates[i].relevance - (1 - mmr_lambda) * redundancy[i])
+        remaining.remove(best)
+        if redundancy[best] >= duplicate_threshold and not any(_adjacent(candidates[best], candidates[j]) for j in selected):
+            duplicates += 1
+            continue
+        text = candidates[best].document.page_content
+        overlap = max(
+            (text_overlap(candidates[j].document.page_content, text) for j in selected
+             if _adjacent(candidates[best], candidates[j])),
+            default=0,
+        )
+        cost = estimate_tokens(text[overlap:])
+        if used + cost > budget_tokens:
+            continue
+        selected.append(best)
+        used += cost
+    return [candidates[i] for i in selected], duplicates
+
+
+def merge_adjacent(selected: List[Candidate]) -> List[Tuple[str, float]]:
+    """
+    Join runs of consecutive chunks from the same source into one passage,
+    dropping the overlap between neighbours. Returns (text, best relevance)
+    per passage, most relevant first.
+    """
+    passages: List[Tuple[str, float]] = []
+    run: List[Candidate] = []
+    for cand in sorted(selected, key=lambda c: (str(c.document.metadata.get("source")), c.position)):
+        if run and not (cand.position == run[-1].position + 1 and _adjacent(run[-1], cand)):
+            passages.append(_join(run))
+            run = []
+        run.append(cand)
+    if run:
+        passages.append(_join(run))
+    return sorted(passages, key=lambda p: p[1], reverse=True)
+
+
+def _join(run: List[Candidate]) -> Tuple[str, float]:
+    text = run[0].document.page_content
+    for prev, cand in zip(run, run[1:]):
+        nxt = cand.document.page_content
+        k = text_overlap(prev.document.page_content, nxt)
+        text += nxt[k:] if k else "\n" + nxt
+    return text, max(c.relevance for c in run)
+
+
+def pack_candidates(
+    candidates: List[Candidate], vectors: Optional[np.ndarray], baseline_k: int
+) -> Tuple[str, Dict[str, Any]]:
+    """Select, dedupe and merge `candidates` into one context string, plus a report."""
+    baseline_tokens = sum(estimate_tokens(c.document.page_content) for c in candidates[:baseline_k])
+    if not candidates:
+        return "", {"candidates": 0, "passages": 0, "baseline_tokens": 0, "packed_tokens": 0, "saved_tokens": 0}
+
+    selected, duplicates = select_mmr(
+        candidates,
+        similarity_matrix(candidates, vectors),
+        settings.context_token_budget,
+        settings.context_mmr_lambda,
+        settings.context_duplicate_threshold,
+    )
+    passages = merge_adjacent(selected)
+    context = "\n\n".join(text for text, _ in passages)
+    packed_tokens = estimate_tokens(context)
+    return context, {
+        "candidates": len(candidates),
+        "selected": len(selected),
+        "passages": len(passages),
+        "duplicates_removed": duplicates,
+        "baseline_tokens": baseline_tokens,
+        "packed_tokens": packed_tokens,
+        # A budget above what top-k stuffing uses can cost tokens; that is
+        # not a saving (both totals are reported above)
+        "saved_tokens": max(0, baseline_tokens - packed_tokens),
+    }
+
+
+async def pack_retrieved_context(
+    vectorstore: FAISS,
+    query: str,
+    baseline_k: int,
+    lexical: Optional[BM25Index] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Retrieve up to CONTEXT_FETCH_K chunks for `query` (hybrid when a BM25
+    index is given) and pack them into a context of at most
+    CONTEXT_TOKEN_BUDGET tokens. The report compares the packed size with
+    stuffing the top `baseline_k` chunks as-is.
+    """
+    query_vector = await embeddings.aembed_query(query)
+    candidates, vectors = await asyncio.to_thread(
+        fetch_candidates, vectorstore, query_vector, max(settings.context_fetch_k, baseline_k), query, lexical
+    )
+    with span("chat.pack_context"):
+        context, report = pack_candidates(candidates, vectors, baseline_k)
+    metrics.incr("context.baseline_tokens", report["baseline_tokens"])
+    metrics.incr("context.packed_tokens", report["packed_tokens"])
+    metrics.incr("context.saved_tokens", report["saved_tokens"])
+    return context, report
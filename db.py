@@ -1,16 +1,61 @@
-from pymongo import MongoClient
+from typing import Any, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
 from config import settings
 
 # ──────────────────────────────────────────────────────────────────────────────
-# MongoDB Initialization
+# MongoDB Initialization (async, via Motor)
 # ──────────────────────────────────────────────────────────────────────────────
 
-# Connect to MongoDB using the URI from app/config.py
-mongo_client = MongoClient(settings.mongo_uri)
-mongo_db = mongo_client[settings.mongo_chat_db]
+# Name of the collection that chat sessions are written to
+chat_collection_name = settings.mongo_chat_collection
 
 # Collection to store metadata that maps user_id → vectorstore_path
-vectorstore_meta_coll = mongo_db["vectorstore_metadata"]
+vectorstore_meta_collection_name = "vectorstore_metadata"
 
-# Name of the collection that MongoDBChatMessageHistory will write to
-chat_collection_name = settings.mongo_chat_collection
+_mongo_client: Optional[Any] = None
+
+
+def create_mongo_client() -> Any:
+    """
+    Build the async Mongo client for the configured backend.
+
+    - "motor": a pooled AsyncIOMotorClient against settings.mongo_uri.
+    - "mongomock": an in-memory mongomock_motor client, for tests and
+      offline benchmarks (requires the optional `mongomock-motor` package).
+    """
+    if settings.mongo_backend == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient
+
+        return AsyncMongoMockClient()
+
+    return AsyncIOMotorClient(
+        settings.mongo_uri,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+        connectTimeoutMS=settings.mongo_connect_timeout_ms,
+        socketTimeoutMS=settings.mongo_socket_timeout_ms,
+    )
+
+
+def get_mongo_client() -> Any:
+    """Return the shared async Mongo client, creating it on first use."""
+    global _mongo_client
+    if _mongo_client is None:
+        _mongo_client = create_mongo_client()
+    return _mongo_client
+
+
+def set_mongo_client(client: Any) -> None:
+    """Swap in a different async client (e.g. a mongomock stand-in in tests)."""
+    global _mongo_client
+    _mongo_client = client
+
+
+def get_chat_collection() -> Any:
+    return get_mongo_client()[settings.mongo_chat_db][chat_collection_name]
+
+
+def get_vectorstore_meta_collection() -> Any:
+    return get_mongo_client()[settings.mongo_chat_db][vectorstore_meta_collection_name]
@@ -0,0 +1,152 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import embed_queries_batch
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Micro-batching embedding scheduler
+# ──────────────────────────────────────────────────────────────────────────────
+
+# (kind, texts, future) where kind is "query" or "document"
+_Request = Tuple[str, List[str], Future]
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model so that concurrent calls share forward passes.
+
+    Calls from any thread or coroutine are queued to one dedicated worker
+    thread, which waits up to `max_wait_ms` for more requests (or until
+    `max_batch_size` texts are waiting), then embeds all queued queries in one
+    batch and all queued documents in another and hands results back to the
+    waiting callers. Queries are run first so they are not held up behind a
+    large ingest.
+    """
+
+    def __init__(self, underlying: Embeddings, max_batch_size: int, max_wait_ms: float):
+        self.underlying = underlying
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.texts_embedded = 0
+        self.max_batch_seen = 0
+        self.requests = 0
+
+    # ── public Embeddings API ────────────────────────────────────────────────
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._submit("document", texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit("query", [text]).result()[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._submit("query", texts).result()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self._submit("document", texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await asyncio.wrap_future(self._submit("query", [text])))[0]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self._submit("query", texts))
+
+    # ── scheduling ───────────────────────────────────────────────────────────
+    def _submit(self, kind: str, texts: List[str]) -> Future:
+        future: Future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self._ensure_worker()
+        self._queue.put((kind, list(texts), future))
+        return future
+
+    def _ensure_worker(self) -> None:
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self) -> List[_Request]:
+        """Block for one request, then gather more until the batch is full or the wait expires."""
+        batch = [self._queue.get()]
+        size = len(batch[0][1])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[1])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            for kind in ("query", "document"):
+                requests = [r for r in batch if r[0] == kind]
+                if requests:
+                    self._embed(kind, requests)
+
+    def _embed(self, kind: str, requests: List[_Request]) -> None:
+        texts = [t for _, request_texts, _ in requests for t in request_texts]
+        try:
+            if kind == "query":
+                vectors = embed_queries_batch(self.underlying, texts)
+            else:
+                vectors = self.underlying.embed_documents(texts)
+        except Exception as e:
+            logger.error("Batched %s embedding of %d texts failed: %s", kind, len(texts), e, exc_info=True)
+            for _, _, future in requests:
+                future.set_exception(e)
+            return
+
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += len(requests)
+            self.texts_embedded += len(texts)
+            self.max_batch_seen = max(self.max_batch_seen, len(texts))
+
+        offset = 0
+        for _, request_texts, future in requests:
+            future.set_result(vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "requests": self.requests,
+                "texts_embedded": self.texts_embedded,
+                "avg_batch_size": self.texts_embedded / self.batches if self.batches else 0.0,
+                "max_batch_size_seen": self.max_batch_seen,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+def get_batcher_stats(embeddings: Any) -> Optional[Dict[str, Any]]:
+    """Return stats of the BatchedEmbeddings in a wrapper chain, else None."""
+    while embeddings is not None:
+        if isinstance(embeddings, BatchedEmbeddings):
+            return embeddings.stats()
+        embeddings = getattr(embeddings, "underlying", None)
+    return None
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Content-addressed, disk-backed embedding cache
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with a persistent SQLite cache.
+
+    Each vector is keyed by sha256(model name, normalization flag, kind, text),
+    where kind is "document" or "query" (BGE prefixes queries with an
+    instruction, so the same text embeds differently in the two roles).
+    When the cache holds more than `max_entries` rows the least recently
+    used ones are evicted.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_name: str,
+        normalize: bool,
+        path: str,
+        max_entries: int,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.normalize = normalize
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings(last_access)"
+        )
+        self._conn.commit()
+
+    def _key(self, kind: str, text: str) -> str:
+        raw = f"{self.model_name}\x00{int(self.normalize)}\x00{kind}\x00{text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self._lock:
+            # SQLite caps bound parameters per statement, so look up in slices
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_access = ? WHERE key IN ({placeholders})",
+                        [now, *batch],
+                    )
+            self._conn.commit()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (overflow,),
+        )
+        self.evictions += overflow
+        logger.info("Evicted %d entries from embedding cache", overflow)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed `texts`, running the model only on texts not already cached."""
+        keys = [self._key("document", t) for t in texts]
+        cached = self._lookup(list(set(keys)))
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+
+        return [list(cached[key]) for key in keys]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries, running the model once on the uncached ones."""
+        keys = [self._key("query", t) for t in texts]
+        cached = self._lookup(list(set(keys)))
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = embed_queries_batch(self.underlying, list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+
+        return [list(cached[key]) for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key("query", text)
+        cached = self._lookup([key])
+        if key in cached:
+            with self._lock:
+                self.hits += 1
+            return cached[key]
+
+        with self._lock:
+            self.misses += 1
+        vector = self.underlying.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            return {
+                "entries": count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def embed_queries_batch(model: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    Embed several queries in one forward pass. Wrappers with their own
+    embed_queries (cache, batcher) are used as-is; for HuggingFace BGE models
+    the query instruction is applied exactly as embed_query does; other
+    models fall back to one embed_query call per text.
+    """
+    embed_queries = getattr(model, "embed_queries", None)
+    if embed_queries is not None:
+        return embed_queries(texts)
+    client = getattr(model, "client", None)
+    instruction = getattr(model, "query_instruction", None)
+    if client is not None and instruction is not None:
+        prepared = [instruction + t.replace("\n", " ") for t in texts]
+        return client.encode(prepared, **getattr(model, "encode_kwargs", {})).tolist()
+    return [model.embed_query(t) for t in texts]
+
+
+def get_cache_stats(embeddings: Any) -> Optional[Dict[str, Any]]:
+    """Return stats of the CachedEmbeddings in a wrapper chain, else None."""
+    while embeddings is not None:
+        if isinstance(embeddings, CachedEmbeddings):
+            return embeddings.stats()
+        embeddings = getattr(embeddings, "underlying", None)
+    return None
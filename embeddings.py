@@ -1,26 +1,54 @@
+import asyncio
 import os
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+import threading
+from typing import Any, Callable, List, Optional
+
+from langchain_core.embeddings import Embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 
+from config import settings
+from embedding_cache import CachedEmbeddings, embed_queries_batch
+from embedding_batcher import BatchedEmbeddings
+from llm_client import PooledChatModel, create_groq_client
+from metrics import llm_metrics_handler
+
 load_dotenv()  # now os.getenv(...) will pick up values from your .env file
 
 
-def get_llm():
+# Optional replacement for the ChatGroq factory (offline benchmarks, tests)
+_llm_factory: Optional[Callable[[], Any]] = None
+
+# The shared, long-lived LLM client (built on first use)
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def set_llm_factory(factory: Optional[Callable[[], Any]]) -> None:
     """
-    Returns a ChatGroq LLM instance (Llama 3.3 70B) using the GROQ API key
-    stored in the environment.
+    Make get_llm() wrap factory() instead of a ChatGroq client (None
+    restores it). Drops the shared client so the next call rebuilds it.
     """
-    from langchain_groq import ChatGroq
+    global _llm_factory, _llm
+    with _llm_lock:
+        _llm_factory = factory
+        _llm = None
+
 
-    llm = ChatGroq(
-        model="meta-llama/llama-4-scout-17b-16e-instruct",
-        temperature=0,
-        max_tokens=4096,
-        api_key=os.getenv("GROQ_API_KEY", "")  # Put your actual GROQ key in .env as GROQ_API_KEY
-    )
-    return llm
+def get_llm():
+    """
+    Returns the shared LLM client: one ChatGroq instance (GROQ_API_KEY from
+    the environment, pooled connections) behind the concurrency limits,
+    rate limiter and retry policy of llm_client.PooledChatModel.
+    """
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                client = _llm_factory() if _llm_factory is not None else create_groq_client()
+                _llm = PooledChatModel(client=client, callbacks=[llm_metrics_handler])
+    return _llm
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 1. Text Splitter (512 tokens per chunk, 100 token overlap)
@@ -30,20 +58,111 @@ text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=100
 # ──────────────────────────────────────────────────────────────────────────────
 # 2. Embeddings Model (HuggingFace BGE) on CPU
 # ──────────────────────────────────────────────────────────────────────────────
-
+# The model is loaded lazily — on first use, or by the startup warmup hook —
+# so importing this module needs neither the network nor the model weights.
 
 HF_TOKEN = os.getenv("HUGGINGFACEHUB_API_TOKEN")
 
-from huggingface_hub import login
-
-login(HF_TOKEN)
-
 model_name = "BAAI/bge-small-en-v1.5"
 model_kwargs = {"device": "cpu"}
 encode_kwargs = {"normalize_embeddings": True}
-embeddings = HuggingFaceBgeEmbeddings(
-    model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs
-)
+
+
+def build_embeddings(base: Optional[Embeddings] = None) -> Embeddings:
+    """
+    Log in to the HF Hub (if a token is set) and load the BGE model, wrapped
+    in the embedding cache and batcher. Pass `base` to wrap a different
+    model instead (e.g. a local stand-in for offline benchmarks).
+    """
+    if base is None:
+        from huggingface_hub import login
+        from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+
+        if HF_TOKEN:
+            login(HF_TOKEN)
+
+        base = HuggingFaceBgeEmbeddings(
+            model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs
+        )
+    model: Embeddings = base
+
+    # Identical chunks (re-uploaded syllabi, textbook chapters) are served from a
+    # persistent cache keyed by text hash + model + normalization.
+    if settings.embedding_cache_enabled:
+        model = CachedEmbeddings(
+            model,
+            model_name=model_name,
+            normalize=encode_kwargs["normalize_embeddings"],
+            path=settings.embedding_cache_path,
+            max_entries=settings.embedding_cache_max_entries,
+        )
+
+    # Concurrent query/chunk embedding calls share batched forward passes
+    if settings.embedding_batching_enabled:
+        model = BatchedEmbeddings(
+            model,
+            max_batch_size=settings.embedding_batch_max_size,
+            max_wait_ms=settings.embedding_batch_max_wait_ms,
+        )
+    return model
+
+
+class LazyEmbeddings(Embeddings):
+    """
+    Embeddings proxy that builds the real model on first use.
+    `underlying` is None until then, so stats lookups never trigger a load.
+    """
+
+    def __init__(self, factory: Callable[[], Embeddings]):
+        self._factory = factory
+        self._model: Optional[Embeddings] = None
+        self._lock = threading.Lock()
+
+    def set_factory(self, factory: Callable[[], Embeddings]) -> None:
+        """Replace the model factory and drop any model already built."""
+        with self._lock:
+            self._factory = factory
+            self._model = None
+
+    @property
+    def underlying(self) -> Optional[Embeddings]:
+        return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self) -> Embeddings:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._factory()
+        return self._model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.load().embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.load().aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.load().aembed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one batch (see embed_queries_batch)."""
+        return embed_queries_batch(self.load(), texts)
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        model = self.load()
+        if hasattr(model, "aembed_queries"):
+            return await model.aembed_queries(texts)
+        return await asyncio.to_thread(embed_queries_batch, model, texts)
+
+
+embeddings = LazyEmbeddings(build_embeddings)
 # ──────────────────────────────────────────────────────────────────────────────
 # 3. Prompt Template for RAG Assistant
 # ──────────────────────────────────────────────────────────────────────────────
@@ -0,0 +1,224 @@
+import json
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from config import settings
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# FAISS index type selection (flat / HNSW / IVF / quantized)
+# ──────────────────────────────────────────────────────────────────────────────
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "sq8", "ivfpq")
+INDEX_META_FILE = "index_meta.json"
+
+
+def choose_index_type(num_vectors: int) -> str:
+    """
+    Pick an index type for a corpus of `num_vectors` chunks. An explicit
+    settings.faiss_index_type wins; "auto" uses exact search for small
+    corpora, HNSW for medium ones and IVF with 8-bit scalar quantization
+    for large ones.
+    """
+    configured = settings.faiss_index_type
+    if configured != "auto":
+        return configured
+    if num_vectors < settings.faiss_auto_hnsw_min_vectors:
+        return "flat"
+    if num_vectors < settings.faiss_auto_ivf_min_vectors:
+        return "hnsw"
+    return "ivf"
+
+
+def _nlist(num_vectors: int) -> int:
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39 or 1))
+
+
+def factory_string(index_type: str, num_vectors: int, dim: int) -> str:
+    """faiss.index_factory description for `index_type`."""
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{settings.faiss_hnsw_m}"
+    if index_type == "ivf":
+        return f"IVF{_nlist(num_vectors)},SQ8"
+    if index_type == "sq8":
+        return "SQ8"
+    if index_type == "ivfpq":
+        m = next(m for m in (48, 32, 24, 16, 8, 4, 2, 1) if dim % m == 0)
+        return f"IVF{_nlist(num_vectors)},PQ{m}"
+    raise ValueError(f"Unknown FAISS index type: {index_type}")
+
+
+def build_index(vectors: np.ndarray, index_type: str) -> Tuple[faiss.Index, str]:
+    """
+    Build and train an L2 index of `index_type` over `vectors`. Types that
+    need more training data than available fall back to flat.
+    Returns (index, factory string).
+    """
+    n, dim = vectors.shape
+    if index_type == "ivfpq" and n < 256 * 4:
+        index_type = "flat"
+    if index_type == "ivf" and n < 1000:
+        index_type = "flat"
+    factory = factory_string(index_type, n, dim)
+    index = faiss.index_factory(dim, factory, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    configure_search_params(index)
+    return index, factory
+
+
+def _mmap_flags() -> List[int]:
+    """
+    Read flags to try, best first. IO_FLAG_MMAP_IFC (faiss >= 1.9) maps the
+    codes of flat, HNSW and scalar-quantized indexes in place; older faiss
+    only has IO_FLAG_MMAP, which maps nothing but IVF inverted lists.
+    """
+    flags = []
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        flags.append(faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    flags.append(faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return flags
+
+
+def read_faiss_index(path: str, mmap: bool) -> faiss.Index:
+    """
+    Read an index file, memory-mapped read-only when `mmap` is set, so that
+    every worker serving it shares one copy of its pages in the OS page
+    cache. Falls back to a normal read for index types FAISS cannot map.
+    The file must not change while a mapped index is in use.
+    """
+    if mmap:
+        for flags in _mmap_flags():
+            try:
+                return faiss.read_index(path, flags)
+            except RuntimeError as e:
+                logger.info("Could not mmap %s with flags %#x (%s)", path, flags, e)
+        logger.info("Reading %s into memory", path)
+    return faiss.read_index(path)
+
+
+def configure_search_params(index: faiss.Index) -> None:
+    """Apply query-time accuracy knobs (nprobe, efSearch) to a loaded index."""
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = settings.faiss_ivf_nprobe
+    except RuntimeError:
+        pass
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = settings.faiss_hnsw_ef_search
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """Best-effort name of the index type of a FAISS index."""
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    if getattr(index, "hnsw", None) is not None:
+        return "hnsw"
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        return "ivfpq" if isinstance(ivf, faiss.IndexIVFPQ) else "ivf"
+    except RuntimeError:
+        pass
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return type(index).__name__
+
+
+def reconstruct_vectors(index: faiss.Index) -> np.ndarray:
+    """All vectors stored in `index` (exact for flat/HNSW, approximate for quantized)."""
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        ivf.make_direct_map()
+    except RuntimeError:
+        pass
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def flat_contents(vectorstore: FAISS) -> Tuple[List[str], np.ndarray, List[Dict[str, Any]]]:
+    """Texts, vectors and metadatas of a vectorstore, in index order."""
+    texts, metadatas = [], []
+    for i in range(vectorstore.index.ntotal):
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+        texts.append(doc.page_content)
+        metadatas.append(dict(doc.metadata))
+    return texts, reconstruct_vectors(vectorstore.index), metadatas
+
+
+def search_many(
+    vectorstore: FAISS, vectors: List[List[float]], k: int
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Top-k (document, L2 distance) pairs for each query vector, from a single
+    matrix search over the index instead of one search per query.
+    """
+    if not vectors:
+        return []
+    queries = np.asarray(vectors, dtype=np.float32)
+    distances, ids = vectorstore.index.search(queries, k)
+    results = []
+    for row_distances, row_ids in zip(distances, ids):
+        hits = []
+        for distance, i in zip(row_distances, row_ids):
+            if i < 0:
+                continue  # fewer than k vectors in the index
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)])
+            if isinstance(doc, Document):
+                hits.append((doc, float(distance)))
+        results.append(hits)
+    return results
+
+
+def apply_index_type(vectorstore: FAISS) -> FAISS:
+    """
+    Swap the vectorstore's flat index for the configured/auto-selected type.
+    Non-flat indexes are left as they are (they were chosen at an earlier build).
+    """
+    index = vectorstore.index
+    if not isinstance(index, faiss.IndexFlat):
+        return vectorstore
+    target = choose_index_type(index.ntotal)
+    if target == "flat":
+        return vectorstore
+
+    started = time.perf_counter()
+    vectors = index.reconstruct_n(0, index.ntotal)
+    new_index, factory = build_index(vectors, target)
+    vectorstore.index = new_index
+    logger.info(
+        "Built %s index (%s) over %d vectors in %.2fs",
+        target, factory, index.ntotal, time.perf_counter() - started,
+    )
+    return vectorstore
+
+
+def write_index_meta(folder_path: str, index: faiss.Index) -> Dict[str, Any]:
+    """Record the index type next to index.faiss and return it."""
+    meta = {
+        "index_type": index_type_of(index),
+        "index_class": type(index).__name__,
+        "ntotal": int(index.ntotal),
+        "dim": int(index.d),
+        "built_at": time.time(),
+    }
+    with open(os.path.join(folder_path, INDEX_META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def read_index_meta(folder_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(folder_path, INDEX_META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
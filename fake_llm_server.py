@@ -0,0 +1,179 @@
+"""
+Local stand-in for the Groq chat completions API, for testing the shared
+LLM client (concurrency limits, rate limiting, retries, hedging) offline.
+
+Answers POST /openai/v1/chat/completions (streaming or not) with a canned
+reply after --latency-ms, advertises an --rpm request quota through the
+same x-ratelimit-* headers Groq sends, answers 429 with retry-after once
+the quota is used up, and fails a random --error-rate share of requests
+with 503.
+
+    python fake_llm_server.py --port 9000 --latency-ms 200 --rpm 60 --error-rate 0.1
+    LLM_BASE_URL=http://127.0.0.1:9000 GROQ_API_KEY=fake uvicorn main:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+class QuotaWindow:
+    """Fixed one-minute request window, like the provider's per-minute quota."""
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def take(self) -> Dict[str, Any]:
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start, self.used = now, 0
+            allowed = self.rpm <= 0 or self.used < self.rpm
+            if allowed:
+                self.used += 1
+            reset = max(0.0, 60 - (now - self.window_start))
+            return {
+                "allowed": allowed,
+                "remaining": max(0, self.rpm - self.used) if self.rpm > 0 else None,
+                "reset": reset,
+            }
+
+
+def make_handler(args: argparse.Namespace, quota: QuotaWindow):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *log_args):
+            if args.verbose:
+                super().log_message(fmt, *log_args)
+
+        def _send_json(self, status: int, body: Dict[str, Any], headers: Dict[str, str]) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}}, {})
+                return
+
+            state = quota.take()
+            headers: Dict[str, str] = {}
+            if state["remaining"] is not None:
+                headers = {
+                    "x-ratelimit-limit-requests": str(quota.rpm),
+                    "x-ratelimit-remaining-requests": str(state["remaining"]),
+                    "x-ratelimit-reset-requests": f"{state['reset']:.2f}s",
+                }
+            if not state["allowed"]:
+                headers["retry-after"] = str(int(state["reset"]) + 1)
+                self._send_json(429, {"error": {"message": "rate limit exceeded", "type": "rate_limit"}}, headers)
+                return
+
+            time.sleep(args.latency_ms / 1000 * random.uniform(1 - args.jitter, 1 + args.jitter))
+            if random.random() < args.error_rate:
+                self._send_json(503, {"error": {"message": "service unavailable"}}, headers)
+                return
+
+            words = reply_words(request.get("messages", []), args.answer_words)
+            if request.get("stream"):
+                self._stream(request, words, headers)
+            else:
+                self._send_json(200, completion(request, words), headers)
+
+        def _stream(self, request: Dict[str, Any], words: List[str], headers: Dict[str, str]) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+            for i, word in enumerate(words):
+                delta = {"content": word + " "}
+                if i == 0:
+                    delta["role"] = "assistant"
+                self._event(chunk(chunk_id, request, delta, None))
+            self._event(chunk(chunk_id, request, {}, "stop"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def _event(self, data: Dict[str, Any]) -> None:
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+    return Handler
+
+
+def reply_words(messages: List[Dict[str, Any]], limit: int) -> List[str]:
+    text = " ".join(str(m.get("content", "")) for m in messages)
+    return (text.split() or ["ok"])[:limit]
+
+
+def completion(request: Dict[str, Any], words: List[str]) -> Dict[str, Any]:
+    prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": " ".join(words)},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+        },
+    }
+
+
+def chunk(chunk_id: str, request: Dict[str, Any], delta: Dict[str, Any], finish_reason) -> Dict[str, Any]:
+    return {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": request.get("model", "fake"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter", type=float, default=0.5, help="Latency varies by ± this fraction")
+    parser.add_argument("--rpm", type=int, default=0, help="Advertised requests-per-minute quota (0 = none)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failed with 503")
+    parser.add_argument("--answer-words", type=int, default=60)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, QuotaWindow(args.rpm)))
+    print(f"Fake LLM server on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
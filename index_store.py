@@ -0,0 +1,174 @@
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+from config import settings
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Versioned, multi-worker safe index storage
+#
+# Layout under ./vectorstores/{user_id}:
+#   versions/0000000007/   one immutable directory per saved index version
+#   CURRENT                generation number of the published version
+#   .write.lock            flock'ed by the process writing a new version
+#   faiss_index/           legacy single-directory layout (generation 0)
+#
+# A new version is written into a staging directory, renamed into versions/
+# and published by atomically replacing CURRENT, so readers in any worker
+# see either the old version or the new one, never a partial write. Since a
+# published directory never changes, every worker can memory-map it and
+# share its pages through the OS page cache.
+# ──────────────────────────────────────────────────────────────────────────────
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+LEGACY_DIR = "faiss_index"
+LOCK_FILE = ".write.lock"
+_STAGING_PREFIX = ".staging-"
+
+
+def read_generation(user_dir: str) -> Optional[int]:
+    """
+    Generation of the user's published index: the number in CURRENT, 0 for
+    a legacy faiss_index/ directory, or None if the user has no index.
+    Cheap enough (one small file read) to call on every request.
+    """
+    try:
+        with open(os.path.join(user_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        pass
+    return 0 if os.path.isdir(os.path.join(user_dir, LEGACY_DIR)) else None
+
+
+def version_dir(user_dir: str, generation: int) -> str:
+    if generation == 0:
+        return os.path.join(user_dir, LEGACY_DIR)
+    return os.path.join(user_dir, VERSIONS_DIR, f"{generation:010d}")
+
+
+def current_index_dir(user_dir: str) -> Optional[str]:
+    """Directory of the published index version, or None if the user has none."""
+    generation = read_generation(user_dir)
+    return version_dir(user_dir, generation) if generation is not None else None
+
+
+# Per-directory thread locks with the number of threads holding or waiting
+# on each, so an entry is dropped when its last user releases it.
+_thread_locks: Dict[str, Tuple[threading.Lock, int]] = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _thread_lock(user_dir: str) -> Iterator[None]:
+    key = os.path.abspath(user_dir)
+    with _thread_locks_guard:
+        lock, users = _thread_locks.get(key, (None, 0))
+        lock = lock or threading.Lock()
+        _thread_locks[key] = (lock, users + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _thread_locks_guard:
+            users = _thread_locks[key][1] - 1
+            if users:
+                _thread_locks[key] = (lock, users)
+            else:
+                del _thread_locks[key]
+
+
+@contextmanager
+def user_write_lock(user_dir: str) -> Iterator[None]:
+    """
+    Exclusive per-user write lock, across threads (a lock per directory) and
+    across worker processes (flock on .write.lock), so two ingests for one
+    user never interleave a read-modify-write of the index.
+    """
+    with _thread_lock(user_dir):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(user_dir, LOCK_FILE), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _fsync_dir(path: str) -> None:
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def publish_version(user_dir: str, write: Callable[[str], None]) -> Tuple[int, str]:
+    """
+    Call write(staging_dir) to fill a new version, then publish it as the
+    next generation. The caller must hold user_write_lock(user_dir).
+    Returns (generation, version directory).
+    """
+    versions = os.path.join(user_dir, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    staging = os.path.join(versions, _STAGING_PREFIX + uuid.uuid4().hex)
+    os.makedirs(staging)
+    try:
+        write(staging)
+        # A writer that crashed between the rename and replacing CURRENT
+        # leaves an unpublished versions/N+1; number past it.
+        numbered = [int(name) for name in os.listdir(versions) if name.isdigit()]
+        generation = max([read_generation(user_dir) or 0] + numbered) + 1
+        target = version_dir(user_dir, generation)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    _fsync_dir(versions)
+
+    current = os.path.join(user_dir, CURRENT_FILE)
+    with open(current + ".tmp", "w", encoding="utf-8") as f:
+        f.write(f"{generation}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current + ".tmp", current)
+    _fsync_dir(user_dir)
+
+    prune_versions(user_dir, generation)
+    return generation, target
+
+
+def prune_versions(user_dir: str, current: int) -> None:
+    """
+    Delete versions older than the INDEX_VERSIONS_RETAINED most recent ones
+    before `current`, and staging directories left by crashed writers.
+    The caller must hold user_write_lock(user_dir). Workers still mapping a
+    deleted version keep reading it until they notice the new generation.
+    """
+    versions = os.path.join(user_dir, VERSIONS_DIR)
+    older = []
+    for name in os.listdir(versions):
+        path = os.path.join(versions, name)
+        if name.startswith(_STAGING_PREFIX):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.isdigit() and int(name) < current:
+            older.append(int(name))
+    if os.path.isdir(os.path.join(user_dir, LEGACY_DIR)):
+        older.append(0)
+
+    for generation in sorted(older, reverse=True)[max(0, settings.index_versions_retained):]:
+        logger.info("Removing index version %d of %s", generation, user_dir)
+        shutil.rmtree(version_dir(user_dir, generation), ignore_errors=True)
@@ -0,0 +1,335 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import settings
+from logging_config import logger
+from metrics import metrics, record, span
+from index_store import user_write_lock
+from parsing import plan_parse_tasks
+from question_bank import question_banks
+from utils import (
+    text_splitter,
+    embeddings,
+    get_vectorstore_path,
+    save_vectorstore_to_disk,
+    upsert_vectorstore_metadata,
+    append_to_vectorstore,
+    build_vectorstore_from_embeddings,
+)
+
+SUPPORTED_SUFFIXES = (".pdf", ".docx")
+
+# ──────────────────────────────────────────────────────────────────────────────
+# 1. Progress tracking for a single ingest run
+# ──────────────────────────────────────────────────────────────────────────────
+@dataclass
+class IngestJob:
+    """State of one ingestion run, updated by the worker as it progresses."""
+    job_id: str
+    user_id: str
+    mode: str
+    status: str = "queued"          # queued → running → succeeded | failed
+    files_total: int = 0
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class IngestError(ValueError):
+    """Raised when uploaded documents cannot be ingested (bad input, not a crash)."""
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# 2. Streaming ingest pipeline (parse → split → embed → index → save)
+# ──────────────────────────────────────────────────────────────────────────────
+_parse_executor: Optional[ProcessPoolExecutor] = None
+_parse_executor_lock = threading.Lock()
+
+
+def get_parse_executor() -> Optional[ProcessPoolExecutor]:
+    """
+    Shared process pool for document parsing (None when parse_workers is 0).
+    Workers are started with settings.parse_start_method, "forkserver" where
+    available (else "spawn"): forking the multi-threaded server (embedding
+    batcher, threadpool, torch) can deadlock the children on locks held by
+    other threads. The fork server preloads only `parsing`. Either way each
+    worker also re-imports the launching script as __mp_main__, which is
+    cheap under the `uvicorn` CLI but imports the whole app for `python main.py`.
+    """
+    global _parse_executor
+    if settings.parse_workers <= 0:
+        return None
+    with _parse_executor_lock:
+        if _parse_executor is None:
+            context = multiprocessing.get_context(settings.parse_start_method)
+            if settings.parse_start_method == "forkserver":
+                context.set_forkserver_preload(["parsing"])
+            _parse_executor = ProcessPoolExecutor(max_workers=settings.parse_workers, mp_context=context)
+        return _parse_executor
+
+
+def iter_pages(uploads: List[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (filename, page text) for every page of every upload, in order.
+
+    Files (and page ranges of large PDFs) are parsed in parallel in worker
+    processes, but only a bounded window of tasks is in flight at once so
+    memory does not grow with the size of the upload.
+    """
+    def tasks():
+        for filename, tmp_path in uploads:
+            suffix = os.path.splitext(filename)[1].lower()
+            if suffix not in SUPPORTED_SUFFIXES:
+                raise IngestError(f"Unsupported file type: {filename}")
+            for fn, args in plan_parse_tasks(tmp_path, suffix, settings.parse_pages_per_task):
+                yield filename, fn, args
+
+    executor = get_parse_executor()
+    if executor is None:
+        for filename, fn, args in tasks():
+            for page in fn(*args):
+                yield filename, page
+        return
+
+    pending: Deque = deque()
+    task_iter = tasks()
+    for filename, fn, args in itertools.islice(task_iter, settings.parse_workers * 2):
+        pending.append((filename, executor.submit(fn, *args)))
+    try:
+        while pending:
+            filename, future = pending.popleft()
+            nxt = next(task_iter, None)
+            if nxt is not None:
+                pending.append((nxt[0], executor.submit(nxt[1], *nxt[2])))
+            for page in future.result():
+                yield filename, page
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def iter_chunks(pages: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+    """
+    Split a stream of (filename, page text) into (filename, chunk) pairs.
+
+    Each page is split together with the trailing chunk of the previous page
+    of the same file, so chunk boundaries match splitting the whole file at
+    once while only a page or so of text is held at a time.
+    """
+    current: Optional[str] = None
+    carry = ""
+    for filename, page in pages:
+        if filename != current:
+            if carry:
+                yield current, carry
+            current, carry = filename, ""
+        text = f"{carry}\n\n{page}" if carry else page
+        chunks = text_splitter.split_text(text)
+        if not chunks:
+            continue
+        for chunk in chunks[:-1]:
+            yield filename, chunk
+        carry = chunks[-1]
+    if carry:
+        yield current, carry
+
+
+def run_ingest(
+    user_id: str,
+    uploads: List[Tuple[str, str]],
+    mode: str = "replace",
+    job: Optional[IngestJob] = None,
+) -> Dict[str, Any]:
+    """
+    Ingest `uploads` — (original filename, temp file path) pairs — for user_id.
+    Temp files are removed when done. Progress is recorded on `job` if given.
+    Returns a dict matching IngestResponse. The caller records the new path
+    with upsert_vectorstore_metadata, which runs on the event loop.
+    """
+    job = job or IngestJob(job_id="inline", user_id=user_id, mode=mode)
+    job.files_total = len(uploads)
+
+    # Parsing, splitting and embedding are interleaved, so their time is
+    # accumulated across batches and recorded once per run
+    seconds = {"parse": 0.0, "split": 0.0, "embed": 0.0, "index_build": 0.0}
+
+    def counted_pages():
+        pages = iter_pages(uploads)
+        while True:
+            started = time.perf_counter()
+            item = next(pages, None)
+            seconds["parse"] += time.perf_counter() - started
+            if item is None:
+                return
+            job.pages_parsed += 1
+            yield item
+
+    # 1-3. Parse, split and embed in batches, growing the index as we go.
+    # Every chunk records the file it came from in its `source` metadata.
+    vs = None
+    try:
+        chunk_iter = iter_chunks(counted_pages())
+        while True:
+            started, parsed = time.perf_counter(), seconds["parse"]
+            batch = list(itertools.islice(chunk_iter, settings.ingest_embed_batch_size))
+            seconds["split"] += time.perf_counter() - started - (seconds["parse"] - parsed)
+            if not batch:
+                break
+            texts = [chunk for _, chunk in batch]
+            metadatas = [{"source": filename} for filename, _ in batch]
+            job.chunks_total += len(texts)
+
+            started = time.perf_counter()
+            vectors = embeddings.embed_documents(texts)
+            seconds["embed"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            if vs is None:
+                vs = build_vectorstore_from_embeddings(texts, vectors, metadatas)
+            else:
+                vs.add_embeddings(text_embeddings=list(zip(texts, vectors)), metadatas=metadatas)
+            seconds["index_build"] += time.perf_counter() - started
+            job.chunks_embedded += len(texts)
+    finally:
+        for stage, elapsed in seconds.items():
+            record(f"ingest.{stage}", elapsed)
+        metrics.incr("ingest.pages", job.pages_parsed)
+        metrics.incr("ingest.chunks", job.chunks_embedded)
+        # Clean up temp files
+        for _, tmp_path in uploads:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    if vs is None:
+        raise IngestError("No valid documents uploaded.")
+
+    # 4. Save (merging into the existing index when appending). The write
+    # lock also holds off ingests for this user in other worker processes.
+    with user_write_lock(get_vectorstore_path(user_id)), span("ingest.save"):
+        if mode == "append":
+            vs = append_to_vectorstore(user_id, vs)
+        faiss_path = save_vectorstore_to_disk(vs, user_id)
+
+    return {
+        "success": True,
+        "message": "Vectorstore updated successfully." if mode == "append" else "Vectorstore created successfully.",
+        "user_id": user_id,
+        "vectorstore_path": faiss_path,
+        "chunks_added": job.chunks_embedded,
+    }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# 3. Background job queue
+# ──────────────────────────────────────────────────────────────────────────────
+class QueueFullError(RuntimeError):
+    """Raised when the ingest queue is at capacity."""
+
+
+class IngestJobManager:
+    """
+    Runs ingest jobs on a worker pool. At most `max_pending` jobs may be
+    queued or running at once; beyond that, submit() raises QueueFullError.
+    Finished jobs are kept (most recent `retention`) so their status can be read.
+    """
+
+    def __init__(self, workers: int, max_pending: int, retention: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_pending = max_pending
+        self.retention = retention
+
+    def submit(self, user_id: str, uploads: List[Tuple[str, str]], mode: str) -> IngestJob:
+        """Queue a job; must be called from the event loop that owns the Mongo client."""
+        loop = asyncio.get_running_loop()
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Ingest queue is full, retry later.")
+
+        job = IngestJob(job_id=str(uuid.uuid4()), user_id=user_id, mode=mode)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._trim()
+        self._executor.submit(self._run, job, uploads, loop)
+        logger.info("Queued ingest job %s for user_id=%s", job.job_id, user_id)
+        return job
+
+    @contextmanager
+    def reserve(self) -> Iterator[None]:
+        """
+        Hold one of the `max_pending` slots while ingesting inline (the
+        synchronous endpoint), so it shares the queue's backpressure.
+        Raises QueueFullError when no slot is free.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Ingest queue is full, retry later.")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _run(
+        self,
+        job: IngestJob,
+        uploads: List[Tuple[str, str]],
+        loop: asyncio.AbstractEventLoop,
+    ) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            result = run_ingest(job.user_id, uploads, job.mode, job)
+            asyncio.run_coroutine_threadsafe(
+                upsert_vectorstore_metadata(job.user_id, result["vectorstore_path"]), loop
+            ).result()
+            if settings.question_bank_enabled:
+                loop.call_soon_threadsafe(question_banks.schedule, job.user_id)
+            job.result = result
+            job.status = "succeeded"
+        except Exception as e:
+            logger.error("Ingest job %s failed: %s", job.job_id, e, exc_info=True)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            self._slots.release()
+
+    def _trim(self) -> None:
+        while len(self._jobs) > self.retention:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.finished_at is None:
+                break
+            self._jobs.pop(oldest_id)
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, user_id: Optional[str] = None) -> List[IngestJob]:
+        with self._lock:
+            return [j for j in self._jobs.values() if user_id is None or j.user_id == user_id]
+
+
+# Single shared job manager
+ingest_jobs = IngestJobManager(
+    workers=settings.ingest_workers,
+    max_pending=settings.ingest_queue_size,
+    retention=settings.ingest_job_retention,
+)
@@ -0,0 +1,441 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Mapping, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from config import settings
+from logging_config import logger
+from metrics import metrics
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Shared LLM client: concurrency limits, rate limiting, retries and hedging
+#
+# One long-lived ChatGroq client (with pooled HTTP connections) is wrapped in
+# PooledChatModel, which every caller gets from embeddings.get_llm(). Each
+# call waits for a global and a per-user concurrency slot and for the rate
+# limiter, which is a token bucket (LLM_RATE_LIMIT_RPM) that also pauses
+# when the provider's x-ratelimit-* / retry-after headers say the quota is
+# used up. Failed calls (429, 5xx, timeouts) are retried with jittered
+# exponential backoff; non-streaming calls can optionally be hedged.
+# ──────────────────────────────────────────────────────────────────────────────
+
+# User on whose behalf LLM calls in the current request/task are made
+_llm_user: ContextVar[Optional[str]] = ContextVar("llm_user", default=None)
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {
+    "APITimeoutError", "APIConnectionError", "TimeoutError",
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "RemoteProtocolError",
+}
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def set_llm_user(user_id: Optional[str]) -> None:
+    """Attribute LLM calls made from the current request (and its tasks) to user_id."""
+    _llm_user.set(user_id)
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a provider duration like "7.66s", "2m59.5s", "120ms" or "30"."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+
+class RateLimiter:
+    """
+    Token bucket over requests (`rpm` per minute, 0 = no local limit) that
+    can additionally be paused until a given time, as dictated by the
+    provider's quota headers. Usable from threads and coroutines.
+    """
+
+    def __init__(self, rpm: float, min_remaining_tokens: int):
+        self.rate = rpm / 60.0
+        # Bursts of up to one second's worth of requests
+        self.capacity = max(1.0, self.rate) if rpm > 0 else 0.0
+        self.min_remaining_tokens = min_remaining_tokens
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.last_headers: Dict[str, str] = {}
+        self.waits = 0
+
+    def _reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until - now)
+            if self.rate > 0:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+            if wait > 0:
+                self.waits += 1
+            return wait
+
+    def _blocked_for(self) -> float:
+        with self._lock:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+    async def acquire(self) -> None:
+        wait = self._reserve()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._blocked_for()
+
+    def acquire_sync(self) -> None:
+        wait = self._reserve()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self._blocked_for()
+
+    def block_for(self, seconds: float) -> None:
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, status_code: int, headers: Mapping[str, str]) -> None:
+        """Follow x-ratelimit-* and retry-after headers from a provider response."""
+        quota = {k.lower(): v for k, v in headers.items() if k.lower().startswith("x-ratelimit") or k.lower() == "retry-after"}
+        if not quota:
+            return
+        self.last_headers = quota
+
+        if status_code == 429:
+            self.block_for(parse_duration(quota.get("retry-after")) or 1.0)
+
+        remaining_requests = quota.get("x-ratelimit-remaining-requests")
+        if remaining_requests is not None and remaining_requests.isdigit():
+            remaining = int(remaining_requests)
+            if remaining == 0:
+                self.block_for(parse_duration(quota.get("x-ratelimit-reset-requests")) or 1.0)
+            elif self.rate > 0:
+                with self._lock:
+                    self._tokens = min(self._tokens, float(remaining))
+
+        remaining_tokens = quota.get("x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None and remaining_tokens.isdigit():
+            if int(remaining_tokens) < self.min_remaining_tokens:
+                self.block_for(parse_duration(quota.get("x-ratelimit-reset-tokens")) or 1.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rpm": self.rate * 60,
+                "tokens": round(self._tokens, 2) if self.rate > 0 else None,
+                "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 3),
+                "waits": self.waits,
+                "last_quota_headers": dict(self.last_headers),
+            }
+
+
+class ConcurrencyLimiter:
+    """
+    Global and per-user caps on LLM calls in flight (async callers). The
+    global semaphore is created on first use in the running event loop.
+    """
+
+    def __init__(self, global_limit: int, per_user_limit: int):
+        self.global_limit = global_limit
+        self.per_user_limit = per_user_limit
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # user_id → [semaphore, callers holding or waiting for it]
+        self._users: Dict[str, List[Any]] = {}
+        self.in_flight = 0
+
+    @property
+    def _global(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.global_limit)
+            self._loop = loop
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str]):
+        user = None
+        if user_id is not None and self.per_user_limit > 0:
+            user = self._users.setdefault(user_id, [asyncio.Semaphore(self.per_user_limit), 0])
+            user[1] += 1
+        try:
+            if user is not None:
+                await user[0].acquire()
+            try:
+                async with self._global:
+                    self.in_flight += 1
+                    metrics.set_gauge("llm.in_flight", self.in_flight)
+                    try:
+                        yield
+                    finally:
+                        self.in_flight -= 1
+                        metrics.set_gauge("llm.in_flight", self.in_flight)
+            finally:
+                if user is not None:
+                    user[0].release()
+        finally:
+            if user is not None:
+                user[1] -= 1
+                if user[1] == 0:
+                    self._users.pop(user_id, None)
+
+    async def try_acquire(self) -> bool:
+        """
+        Take an extra global slot only if one is free right now (for hedged
+        requests, which must not wait); pair a True result with release().
+        """
+        if self._global.locked():
+            return False
+        await self._global.acquire()
+        self.in_flight += 1
+        metrics.set_gauge("llm.in_flight", self.in_flight)
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        metrics.set_gauge("llm.in_flight", self.in_flight)
+        self._global.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "global_limit": self.global_limit,
+            "per_user_limit": self.per_user_limit,
+            "active_users": len(self._users),
+        }
+
+
+rate_limiter = RateLimiter(settings.llm_rate_limit_rpm, settings.llm_min_remaining_tokens)
+concurrency_limiter = ConcurrencyLimiter(settings.llm_max_concurrency, settings.llm_max_concurrency_per_user)
+# Sync callers (rare; the API is async) share a plain thread-level cap
+_sync_slots = threading.BoundedSemaphore(settings.llm_max_concurrency)
+
+
+def retry_delay(error: BaseException, attempt: int) -> Optional[float]:
+    """
+    Seconds to wait before retrying after `error` on attempt `attempt`
+    (0-based), or None if the error is not worth retrying. Uses full-jitter
+    exponential backoff, but never less than the server's retry-after.
+    """
+    status = getattr(error, "status_code", None)
+    if status not in _RETRYABLE_STATUS and type(error).__name__ not in _RETRYABLE_ERRORS:
+        return None
+    ceiling = min(settings.llm_retry_max_delay_seconds, settings.llm_retry_base_delay_seconds * 2 ** attempt)
+    delay = random.uniform(0, ceiling)
+    response = getattr(error, "response", None)
+    retry_after = parse_duration(getattr(response, "headers", {}).get("retry-after")) if response is not None else None
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _should_retry(error: BaseException, attempt: int) -> Optional[float]:
+    if attempt >= settings.llm_max_retries:
+        return None
+    delay = retry_delay(error, attempt)
+    if delay is not None:
+        metrics.incr("llm.retries")
+        logger.warning("LLM call failed (%s: %s); retry %d in %.2fs", type(error).__name__, error, attempt + 1, delay)
+    return delay
+
+
+async def _attempt(call: Callable[[], Awaitable[Any]]) -> Any:
+    await rate_limiter.acquire()
+    return await call()
+
+
+async def _hedged(call: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run `call`; if it has not finished after LLM_HEDGE_AFTER_MS, start a
+    second identical request and return whichever succeeds first. The
+    backup takes its own global concurrency slot and is skipped when none
+    is free or the provider has asked us to back off.
+    """
+    delay = settings.llm_hedge_after_ms / 1000
+    if delay <= 0:
+        return await _attempt(call)
+
+    primary = asyncio.ensure_future(_attempt(call))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+
+    if rate_limiter._blocked_for() > 0 or not await concurrency_limiter.try_acquire():
+        metrics.incr("llm.hedges_skipped")
+        return await primary
+
+    metrics.incr("llm.hedged")
+    backup = asyncio.ensure_future(_attempt(call))
+    # Cancelled tasks finish later, so free the slot once the backup is done
+    backup.add_done_callback(lambda _: concurrency_limiter.release())
+    pending = {primary, backup}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        metrics.incr("llm.hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class PooledChatModel(BaseChatModel):
+    """
+    Chat model that forwards to a shared underlying `client` (ChatGroq)
+    under the concurrency limiter, rate limiter and retry policy above.
+    """
+
+    client: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return f"pooled-{self.client._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return getattr(self.client, "_identifying_params", {})
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # The slot is only held during an attempt, not while backing off
+        attempt = 0
+        while True:
+            try:
+                with _sync_slots:
+                    rate_limiter.acquire_sync()
+                    return self.client._generate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                delay = _should_retry(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # The slot is only held during an attempt, not while backing off
+        user_id = _llm_user.get()
+        attempt = 0
+        while True:
+            try:
+                async with concurrency_limiter.slot(user_id):
+                    return await _hedged(lambda: self.client._agenerate(messages, stop=stop, **kwargs))
+            except Exception as e:
+                delay = _should_retry(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        # Retried only until the first chunk has been passed on; the slot is
+        # only held during an attempt, not while backing off
+        user_id = _llm_user.get()
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with concurrency_limiter.slot(user_id):
+                    await rate_limiter.acquire()
+                    async for chunk in self.client._astream(messages, stop=stop, **kwargs):
+                        started = True
+                        if run_manager:
+                            await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                        yield chunk
+                return
+            except Exception as e:
+                delay = None if started else _should_retry(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+def _record_quota(response) -> None:
+    rate_limiter.update_from_headers(response.status_code, response.headers)
+
+
+async def _arecord_quota(response) -> None:
+    rate_limiter.update_from_headers(response.status_code, response.headers)
+
+
+def create_groq_client() -> BaseChatModel:
+    """
+    ChatGroq client with pooled, long-lived HTTP connections whose responses
+    feed the rate limiter. LLM_BASE_URL points it at another server (e.g. a
+    local fake for tests); the SDK's own retries are off since
+    PooledChatModel retries.
+    """
+    import httpx
+    from langchain_groq import ChatGroq
+
+    limits = httpx.Limits(
+        max_connections=settings.llm_max_concurrency * 2,
+        max_keepalive_connections=settings.llm_max_concurrency,
+    )
+    timeout = httpx.Timeout(settings.llm_timeout_seconds)
+    kwargs: Dict[str, Any] = {}
+    if settings.llm_base_url:
+        kwargs["base_url"] = settings.llm_base_url
+    return ChatGroq(
+        model=settings.llm_model,
+        temperature=0,
+        max_tokens=4096,
+        api_key=settings.groq_api_key,
+        max_retries=0,
+        timeout=settings.llm_timeout_seconds,
+        http_client=httpx.Client(limits=limits, timeout=timeout, event_hooks={"response": [_record_quota]}),
+        http_async_client=httpx.AsyncClient(limits=limits, timeout=timeout, event_hooks={"response": [_arecord_quota]}),
+        **kwargs,
+    )
+
+
+def get_llm_pool_stats() -> Dict[str, Any]:
+    return {
+        "concurrency": concurrency_limiter.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "max_retries": settings.llm_max_retries,
+        "hedge_after_ms": settings.llm_hedge_after_ms,
+    }
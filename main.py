@@ -1,10 +1,43 @@
 # main.py
 
+import asyncio
 import os
+import time
+from contextlib import asynccontextmanager
+
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 import uvicorn
 
-from routes import router as rag_router
+from config import settings
+from metrics import MetricsMiddleware, metrics, monitor_event_loop_lag
+from llm_client import get_llm_pool_stats
+from routes import collect_cache_stats, router as rag_router
+from utils import llm_call_stats
+from startup import record_timing, resource_status, warmup_embeddings, warmup_mongo
+
+record_timing("import", _import_started)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    With WARMUP_ON_STARTUP, load the embedding model and connect to Mongo
+    before serving; otherwise both are created on first use. Also samples
+    event-loop lag for /metrics while the app runs.
+    """
+    if settings.warmup_on_startup:
+        await run_in_threadpool(warmup_embeddings)
+        await warmup_mongo()
+    lag_monitor = None
+    if settings.event_loop_lag_interval_seconds > 0:
+        lag_monitor = asyncio.create_task(monitor_event_loop_lag(settings.event_loop_lag_interval_seconds))
+    yield
+    if lag_monitor is not None:
+        lag_monitor.cancel()
 
 
 def create_app() -> FastAPI:
@@ -12,11 +45,15 @@ def create_app() -> FastAPI:
         title="RAG Service",
         description="API for document ingestion and RAG-powered chat",
         version="1.0.0",
+        lifespan=lifespan,
     )
 
     # Mount your router
     app.include_router(rag_router)
 
+    # In-flight gauge, request timings and optional Server-Timing headers
+    app.add_middleware(MetricsMiddleware)
+
     return app
 
 app = create_app()
@@ -28,6 +65,35 @@ async def Welcome():
     """
     return {"message": "Welcome to the RAG API! Use /rag/ingest to upload documents or /rag/chat to start chatting."}
 
+@app.get("/health")
+async def health():
+    """
+    Liveness check: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness check: which heavy resources are loaded, and startup timings.
+    Returns 503 until warmup has finished when WARMUP_ON_STARTUP is set.
+    """
+    status = resource_status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Per-stage latency (ingest and chat), LLM call and token counters,
+    event-loop lag and in-flight gauges, plus cache statistics.
+    """
+    return {
+        **metrics.snapshot(),
+        "llm_calls_by_mode": llm_call_stats,
+        "llm_pool": get_llm_pool_stats(),
+        "caches": collect_cache_stats(),
+    }
+
 
 if __name__ == "__main__":
     # Host and port can be overridden via environment variables
@@ -41,4 +107,3 @@ if __name__ == "__main__":
         port=port,
         reload=reload,
     )
-
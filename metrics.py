@@ -0,0 +1,225 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from config import settings
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Stage timings, counters and gauges (exposed at GET /metrics)
+#
+# Stages are named "<area>.<stage>", e.g. "chat.retrieve" or "ingest.embed".
+# Every span is aggregated process-wide; spans recorded while serving an HTTP
+# request are also collected for that request and, with
+# METRICS_TIMING_HEADERS, returned in its Server-Timing header.
+# ──────────────────────────────────────────────────────────────────────────────
+
+class _StageStats:
+    """Count, total and max of a stage, plus a window of recent samples for percentiles."""
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+
+        def pct(q: float) -> float:
+            return round(recent[min(len(recent) - 1, int(q * len(recent)))] * 1000, 3)
+
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": pct(0.50) if recent else 0.0,
+            "p95_ms": pct(0.95) if recent else 0.0,
+            "p99_ms": pct(0.99) if recent else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Metrics:
+    """Thread-safe registry of stage timings, counters and gauges."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.started_at = time.time()
+        self._stages: Dict[str, _StageStats] = {}
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = _StageStats(self.window)
+            stats.observe(seconds)
+
+    def incr(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def set_gauge(self, gauge: str, value: float) -> None:
+        with self._lock:
+            self._gauges[gauge] = value
+
+    def add_gauge(self, gauge: str, delta: float) -> None:
+        with self._lock:
+            self._gauges[gauge] = self._gauges.get(gauge, 0) + delta
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "stages": {name: s.snapshot() for name, s in sorted(self._stages.items())},
+                "counters": dict(sorted(self._counters.items())),
+                "gauges": dict(sorted(self._gauges.items())),
+            }
+
+
+# Single shared registry
+metrics = Metrics(window=settings.metrics_window)
+
+# Stage timings (ms) of the request being served, if any
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def record(stage: str, seconds: float) -> None:
+    """Record a stage duration globally and on the current request."""
+    metrics.observe(stage, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the enclosed block (sync or async code) as `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that tracks in-flight HTTP requests, times each request
+    and collects its stage spans; with METRICS_TIMING_HEADERS the spans
+    recorded before the response starts are sent as a Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start" and settings.metrics_timing_headers:
+                timings["app"] = (time.perf_counter() - started) * 1000
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing_header(timings).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        metrics.add_gauge("http.in_flight", 1)
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            metrics.add_gauge("http.in_flight", -1)
+            metrics.observe("http.request", time.perf_counter() - started)
+            _request_timings.reset(token)
+
+
+async def monitor_event_loop_lag(interval: float) -> None:
+    """
+    Sleep `interval` seconds in a loop and record how late each wake-up is;
+    sustained lag means blocking work is running on the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        metrics.observe("event_loop.lag", lag)
+        metrics.set_gauge("event_loop.lag_ms", round(lag * 1000, 3))
+        if lag > 1.0:
+            logger.warning("Event loop lagged %.2fs behind schedule", lag)
+
+
+def record_llm_usage(response: Any) -> Dict[str, int]:
+    """
+    Add the token usage reported in an LLMResult to the llm.* counters and
+    return it ({"prompt_tokens": .., "completion_tokens": ..}, zeros if unknown).
+    """
+    usage = dict((getattr(response, "llm_output", None) or {}).get("token_usage") or {})
+    if not usage:
+        for generation in (g for gens in getattr(response, "generations", []) for g in gens):
+            meta = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + meta.get("input_tokens", 0)
+            usage["completion_tokens"] = usage.get("completion_tokens", 0) + meta.get("output_tokens", 0)
+    counts = {
+        "prompt_tokens": int(usage.get("prompt_tokens") or 0),
+        "completion_tokens": int(usage.get("completion_tokens") or 0),
+    }
+    metrics.incr("llm.calls")
+    metrics.incr("llm.prompt_tokens", counts["prompt_tokens"])
+    metrics.incr("llm.completion_tokens", counts["completion_tokens"])
+    return counts
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """
+    Callback handler attached to every LLM client: times each call as
+    "llm.call" and counts calls, errors and tokens.
+    """
+
+    def __init__(self):
+        self._started: Dict[UUID, float] = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            record("llm.call", time.perf_counter() - started)
+        record_llm_usage(response)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._started.pop(run_id, None)
+        metrics.incr("llm.errors")
+
+
+# Shared handler passed to LLM clients by embeddings.get_llm()
+llm_metrics_handler = LLMMetricsHandler()
@@ -0,0 +1,47 @@
+from typing import Any, Callable, List, Tuple
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Document parsing tasks for the ingest process pool.
+#
+# Kept free of app imports (settings, embeddings, Mongo) so worker processes
+# stay cheap to start whichever multiprocessing start method is in use.
+# ──────────────────────────────────────────────────────────────────────────────
+
+ParseTask = Tuple[Callable[..., List[str]], Tuple[Any, ...]]
+
+
+def count_pdf_pages(path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def extract_pdf_pages(path: str, start: int, end: int) -> List[str]:
+    """Return the text of pages [start, end) of a PDF."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def extract_docx_text(path: str) -> List[str]:
+    """Return the text of a DOCX file as a single page."""
+    import docx2txt
+
+    return [docx2txt.process(path) or ""]
+
+
+def plan_parse_tasks(path: str, suffix: str, pages_per_task: int) -> List[ParseTask]:
+    """
+    Split one file into independent parse tasks: page ranges for PDFs,
+    the whole document for DOCX.
+    """
+    if suffix == ".pdf":
+        total = count_pdf_pages(path)
+        return [
+            (extract_pdf_pages, (path, start, min(start + pages_per_task, total)))
+            for start in range(0, total, pages_per_task)
+        ]
+    if suffix == ".docx":
+        return [(extract_docx_text, (path,))]
+    raise ValueError(f"Unsupported file type: {suffix}")
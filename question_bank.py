@@ -0,0 +1,399 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from chunk_store import iter_documents
+from config import settings
+from embeddings import embeddings, get_llm, user_prompt
+from llm_client import set_llm_user
+from logging_config import logger
+from metrics import metrics, span
+from utils import load_vectorstore_from_disk
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Question bank: quiz questions generated once per section after ingestion,
+# then sampled by topic and difficulty without any LLM call
+#
+# On disk, in the user's vectorstore directory (next to faiss_index/):
+#   question_bank_vectors.npy  float32[n, d], embedding of each question
+#   question_bank.json         the questions, their sections and build info
+#
+# Sections are runs of consecutive chunks of one source, keyed by a hash of
+# their text, so rebuilding after an append only generates the new sections.
+# ──────────────────────────────────────────────────────────────────────────────
+
+BANK_FILE = "question_bank.json"
+VECTORS_FILE = "question_bank_vectors.npy"
+
+QUESTION_TYPES = ("multiple-choice", "true/false", "short answer")
+DIFFICULTIES = ("easy", "medium", "hard")
+
+_TYPE_ALIASES = {
+    "multiple-choice": "multiple-choice",
+    "multiple choice": "multiple-choice",
+    "mcq": "multiple-choice",
+    "mcqs": "multiple-choice",
+    "true/false": "true/false",
+    "true-false": "true/false",
+    "true or false": "true/false",
+    "tf": "true/false",
+    "short answer": "short answer",
+    "short-answer": "short answer",
+}
+
+
+def normalize_question_type(quiz_type: str) -> Optional[str]:
+    """Canonical question type for `quiz_type` (None if the bank has no such type)."""
+    return _TYPE_ALIASES.get(" ".join(quiz_type.lower().split()))
+
+
+def normalize_difficulty(difficulty: str) -> Optional[str]:
+    value = difficulty.strip().lower()
+    return value if value in DIFFICULTIES else None
+
+
+def bank_request_text() -> str:
+    """Phrase the bank request as the user requirements expected by user_prompt."""
+    n = settings.question_bank_questions_per_level
+    return (
+        f"Create a question bank from this context: {n} multiple-choice, {n} true/false and "
+        f"{n} short answer questions at each difficulty (easy, medium and hard). "
+        "Respond with a JSON array only, no other text. Each item must be an object with "
+        '"type" ("multiple-choice", "true/false" or "short answer"), "difficulty" ("easy", '
+        '"medium" or "hard"), "question", "options" (an object with keys "A" to "D", '
+        'multiple-choice only), "answer" and "explanation".'
+    )
+
+
+def parse_bank_response(text: str) -> List[Dict[str, Any]]:
+    """
+    Valid questions from an LLM reply expected to hold a JSON array. Items
+    with an unknown type or difficulty, or missing fields, are dropped; an
+    "I don't know" reply gives no questions.
+    """
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end <= start:
+        return []
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return []
+
+    questions = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        qtype = normalize_question_type(str(item.get("type", "")))
+        difficulty = normalize_difficulty(str(item.get("difficulty", "")))
+        question = str(item.get("question") or "").strip()
+        answer = str(item.get("answer") or "").strip()
+        if not (qtype and difficulty and question and answer):
+            continue
+        entry = {
+            "type": qtype,
+            "difficulty": difficulty,
+            "question": question,
+            "answer": answer,
+            "explanation": str(item.get("explanation") or "").strip(),
+        }
+        if qtype == "multiple-choice":
+            options = item.get("options")
+            if not isinstance(options, dict) or len(options) < 2:
+                continue
+            entry["options"] = {str(k): str(v) for k, v in options.items()}
+        questions.append(entry)
+    return questions
+
+
+def split_sections(documents: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    Group chunks (in index order) into sections of consecutive chunks from
+    the same source, up to QUESTION_BANK_SECTION_CHARS characters each.
+    """
+    sections: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    for doc in documents:
+        source = doc.metadata.get("source")
+        text = doc.page_content
+        if (
+            current is None
+            or current["source"] != source
+            or len(current["text"]) + len(text) > settings.question_bank_section_chars
+        ):
+            current = {"source": source, "text": text}
+            sections.append(current)
+        else:
+            current["text"] += "\n\n" + text
+    for section in sections:
+        section["id"] = hashlib.sha1(section["text"].encode("utf-8")).hexdigest()
+    return sections
+
+
+def get_bank_dir(user_id: str) -> str:
+    return os.path.join(settings.vectorstore_base_path, user_id)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Loading and saving
+# ──────────────────────────────────────────────────────────────────────────────
+@dataclass
+class QuestionBank:
+    questions: List[Dict[str, Any]]
+    vectors: np.ndarray
+    # section id → indexes of its questions
+    sections: Dict[str, List[int]]
+    built_at: float
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, Dict[str, int]] = {t: {d: 0 for d in DIFFICULTIES} for t in QUESTION_TYPES}
+        for q in self.questions:
+            counts[q["type"]][q["difficulty"]] += 1
+        return {
+            "questions": len(self.questions),
+            "sections": len(self.sections),
+            "built_at": self.built_at,
+            "by_type": counts,
+        }
+
+
+def write_question_bank(folder_path: str, bank: QuestionBank) -> None:
+    """Write the bank, renaming each file into place (questions last, as the version marker)."""
+    vectors_path = os.path.join(folder_path, VECTORS_FILE)
+    with open(vectors_path + ".tmp", "wb") as f:
+        np.save(f, bank.vectors.astype(np.float32))
+    os.replace(vectors_path + ".tmp", vectors_path)
+
+    bank_path = os.path.join(folder_path, BANK_FILE)
+    with open(bank_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"questions": bank.questions, "sections": bank.sections, "built_at": bank.built_at}, f)
+    os.replace(bank_path + ".tmp", bank_path)
+
+
+def read_question_bank(folder_path: str) -> Optional[QuestionBank]:
+    try:
+        with open(os.path.join(folder_path, BANK_FILE), encoding="utf-8") as f:
+            data = json.load(f)
+        vectors = np.load(os.path.join(folder_path, VECTORS_FILE))
+    except (OSError, ValueError):
+        return None
+    if len(vectors) != len(data["questions"]):
+        return None  # caught between the two renames of a rewrite
+    return QuestionBank(data["questions"], vectors, data["sections"], data["built_at"])
+
+
+_cache: "OrderedDict[Tuple[str, int], QuestionBank]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_question_bank(user_id: str) -> Optional[QuestionBank]:
+    """The user's saved question bank (None if none), cached per file version."""
+    folder_path = get_bank_dir(user_id)
+    try:
+        version = os.stat(os.path.join(folder_path, BANK_FILE)).st_mtime_ns
+    except OSError:
+        return None
+    key = (user_id, version)
+    with _cache_lock:
+        bank = _cache.get(key)
+        if bank is not None:
+            _cache.move_to_end(key)
+            return bank
+    bank = read_question_bank(folder_path)
+    if bank is None:
+        return None
+    with _cache_lock:
+        for stale in [k for k in _cache if k[0] == user_id]:
+            del _cache[stale]
+        _cache[key] = bank
+        while len(_cache) > settings.vectorstore_cache_max_entries:
+            _cache.popitem(last=False)
+    return bank
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Building (background stage after ingestion)
+# ──────────────────────────────────────────────────────────────────────────────
+async def _generate_section(
+    section: Dict[str, Any], semaphore: asyncio.Semaphore
+) -> Optional[List[Dict[str, Any]]]:
+    """Questions generated for one section, or None if the LLM call failed."""
+    messages = user_prompt.format_messages(context=section["text"], question=bank_request_text())
+    async with semaphore:
+        try:
+            with span("question_bank.generate"):
+                response = await get_llm().ainvoke(messages)
+        except Exception as e:
+            logger.error("Question bank section %s failed: %s", section["id"][:12], e, exc_info=True)
+            metrics.incr("question_bank.section_errors")
+            return None
+    questions = parse_bank_response(getattr(response, "content", response))
+    for q in questions:
+        q["source"] = section["source"]
+        q["section_id"] = section["id"]
+    return questions
+
+
+async def build_question_bank(user_id: str, status: Optional[Dict[str, Any]] = None) -> QuestionBank:
+    """
+    Generate the question bank for the user's saved vectorstore and write it
+    next to it. Sections already in the previous bank keep their questions;
+    the others are generated, at most QUESTION_BANK_CONCURRENCY at a time.
+    Sections whose generation failed are left out of the bank, so the next
+    build retries them. Progress is recorded in `status` if given.
+    """
+    status = status if status is not None else {}
+    set_llm_user(user_id)
+
+    def read_sections() -> List[Dict[str, Any]]:
+        vs = load_vectorstore_from_disk(user_id)
+        return split_sections(iter_documents(vs.docstore, vs.index_to_docstore_id, vs.index.ntotal))
+
+    sections = await asyncio.to_thread(read_sections)
+    previous = get_question_bank(user_id)
+    known = previous.sections if previous is not None else {}
+    todo = list({s["id"]: s for s in sections if s["id"] not in known}.values())
+    status.update({"sections_total": len(sections), "sections_reused": len(sections) - len(todo), "sections_done": 0})
+
+    semaphore = asyncio.Semaphore(settings.question_bank_concurrency)
+    generated: Dict[str, Optional[List[Dict[str, Any]]]] = {}
+
+    async def run(section: Dict[str, Any]) -> None:
+        generated[section["id"]] = await _generate_section(section, semaphore)
+        status["sections_done"] += 1
+
+    await asyncio.gather(*(run(s) for s in todo))
+    failed = {sid for sid, qs in generated.items() if qs is None}
+    todo = [s for s in todo if s["id"] not in failed]
+    status["sections_failed"] = len(failed)
+
+    new_questions = [q for s in todo for q in generated[s["id"]]]
+    new_vectors = np.zeros((0, 0), dtype=np.float32)
+    if new_questions:
+        with span("question_bank.embed"):
+            new_vectors = np.asarray(
+                await embeddings.aembed_documents([q["question"] for q in new_questions]), dtype=np.float32
+            )
+    new_spans: Dict[str, Tuple[int, int]] = {}
+    offset = 0
+    for section in todo:
+        new_spans[section["id"]] = (offset, offset + len(generated[section["id"]]))
+        offset += len(generated[section["id"]])
+
+    # Assemble in section order, dropping sections no longer in the corpus
+    questions: List[Dict[str, Any]] = []
+    rows: List[np.ndarray] = []
+    by_section: Dict[str, List[int]] = {}
+    for section in sections:
+        sid = section["id"]
+        if sid in by_section or sid in failed:
+            continue  # identical text repeated within the corpus, or retried next build
+        if sid in new_spans:
+            begin, end = new_spans[sid]
+            picked = list(zip(new_questions[begin:end], new_vectors[begin:end]))
+        else:
+            picked = [(previous.questions[i], previous.vectors[i]) for i in known[sid]]
+        by_section[sid] = list(range(len(questions), len(questions) + len(picked)))
+        for question, vector in picked:
+            questions.append(question)
+            rows.append(vector)
+
+    bank = QuestionBank(
+        questions=questions,
+        vectors=np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.float32),
+        sections=by_section,
+        built_at=time.time(),
+    )
+    await asyncio.to_thread(write_question_bank, get_bank_dir(user_id), bank)
+    metrics.incr("question_bank.questions_generated", len(new_questions))
+    return bank
+
+
+class QuestionBankBuilder:
+    """
+    Runs question bank builds as background tasks on the event loop, one at
+    a time per user. Scheduling a user whose build is running queues one
+    more build after it, so the bank always catches up with the last ingest.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._rerun: set = set()
+        self._status: Dict[str, Dict[str, Any]] = {}
+
+    def schedule(self, user_id: str) -> Dict[str, Any]:
+        """Start (or queue) a build for user_id; must be called on the event loop."""
+        task = self._tasks.get(user_id)
+        if task is not None and not task.done():
+            self._rerun.add(user_id)
+            self._status[user_id]["rerun_queued"] = True
+        else:
+            self._status[user_id] = {"status": "queued", "queued_at": time.time()}
+            self._tasks[user_id] = asyncio.create_task(self._run(user_id))
+        return self.status(user_id)
+
+    async def _run(self, user_id: str) -> None:
+        while True:
+            status = {"status": "building", "started_at": time.time()}
+            self._status[user_id] = status
+            try:
+                bank = await build_question_bank(user_id, status)
+                status.update({"status": "ready", "questions": len(bank.questions)})
+                logger.info("Question bank for user_id=%s: %d questions", user_id, len(bank.questions))
+            except Exception as e:
+                logger.error("Question bank build for user_id=%s failed: %s", user_id, e, exc_info=True)
+                status.update({"status": "failed", "error": str(e)})
+            status["finished_at"] = time.time()
+            if user_id not in self._rerun:
+                break
+            self._rerun.discard(user_id)
+        self._tasks.pop(user_id, None)
+
+    def status(self, user_id: str) -> Optional[Dict[str, Any]]:
+        status = self._status.get(user_id)
+        return dict(status) if status is not None else None
+
+
+# Single shared builder
+question_banks = QuestionBankBuilder()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Sampling (no LLM call)
+# ──────────────────────────────────────────────────────────────────────────────
+async def sample_questions(
+    bank: QuestionBank,
+    topic: str,
+    quiz_type: str,
+    difficulty: str,
+    num_questions: int,
+) -> List[Dict[str, Any]]:
+    """
+    Pick `num_questions` questions of `quiz_type` and `difficulty` about
+    `topic`: the closest QUESTION_BANK_SAMPLE_POOL_FACTOR × num_questions
+    matches by embedding similarity, sampled at random so repeated quizzes
+    on a topic vary. May return fewer if the bank has fewer.
+    """
+    mask = np.fromiter(
+        (q["type"] == quiz_type and q["difficulty"] == difficulty for q in bank.questions),
+        dtype=bool, count=len(bank.questions),
+    )
+    candidates = np.flatnonzero(mask)
+    if not len(candidates):
+        return []
+
+    with span("quiz.bank_embed_topic"):
+        topic_vector = np.asarray(await embeddings.aembed_query(topic), dtype=np.float32)
+    scores = bank.vectors[candidates] @ topic_vector
+    pool_size = min(len(candidates), num_questions * settings.question_bank_sample_pool_factor)
+    pool = np.argsort(-scores, kind="stable")[:pool_size]
+    picked = sorted(random.sample(list(pool), min(num_questions, len(pool))), key=lambda j: -scores[j])
+    return [{**bank.questions[candidates[j]], "score": round(float(scores[j]), 4)} for j in picked]
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Tuple
+
+from fastapi import HTTPException
+from langchain.prompts import PromptTemplate
+
+from config import settings
+from embeddings import get_llm
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Course recommendations, memoized by (course, score band)
+# ──────────────────────────────────────────────────────────────────────────────
+
+recommendation_prompt = PromptTemplate.from_template("""
+    You are an academic advisor. A student just completed the course "{course}"
+    with a score of {marks}%. Recommend three specific next-step university
+    or online courses, and briefly explain why each is a good fit given their performance.
+    in the output only provide the course names, separated by commas.
+    Do not include any other text or explanations.
+    Example output:
+    "Advanced Physics, Data Science Fundamentals, Machine Learning Basics"
+    """)
+
+# (normalized course, band) → (recommendation, created_at)
+_memo: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+# Requests currently being generated, so concurrent duplicates share one LLM call
+_in_flight: Dict[Tuple[str, str], "asyncio.Future"] = {}
+memo_stats = {"hits": 0, "misses": 0}
+
+
+def marks_band(marks: float) -> str:
+    """Bucket a percentage score into a band like "80-89"."""
+    width = settings.recommendation_marks_band
+    low = int(max(0.0, min(marks, 100.0)) // width) * width
+    if low >= 100:
+        return "100"
+    return f"{low}-{min(low + width - 1, 100)}"
+
+
+def _memo_key(course: str, marks: float) -> Tuple[str, str]:
+    return " ".join(course.lower().split()), marks_band(marks)
+
+
+def _remember(key: Tuple[str, str], result: Any) -> None:
+    """Memoize `result`, dropping expired and then oldest entries beyond the cap."""
+    now = time.time()
+    _memo.pop(key, None)
+    _memo[key] = (result, now)
+    if len(_memo) > settings.recommendation_cache_max_entries:
+        for old_key in [k for k, (_, ts) in _memo.items() if now - ts > settings.recommendation_ttl_seconds]:
+            del _memo[old_key]
+        while len(_memo) > settings.recommendation_cache_max_entries:
+            del _memo[next(iter(_memo))]
+
+
+async def recommend_courses(course: str, marks: float) -> Any:
+    """
+    Recommend three next-step courses based on the completed `course` and `marks`.
+    Results are memoized per (course, score band) for recommendation_ttl_seconds.
+    """
+    key = _memo_key(course, marks)
+    now = time.time()
+    cached = _memo.get(key)
+    if cached is not None and now - cached[1] <= settings.recommendation_ttl_seconds:
+        memo_stats["hits"] += 1
+        return cached[0]
+
+    pending = _in_flight.get(key)
+    if pending is not None:
+        memo_stats["hits"] += 1
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if not pending.cancelled():
+                raise  # this request was cancelled, not the leader
+        # The leading request was cancelled (client disconnect): take over
+        return await recommend_courses(course, marks)
+
+    memo_stats["misses"] += 1
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        prompt_text = recommendation_prompt.format(course=course, marks=key[1])
+        result = await get_llm().ainvoke(prompt_text)
+        _remember(key, result)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        logger.error(f"Course recommendation error: {e}", exc_info=True)
+        error = HTTPException(status_code=500, detail="Could not generate course recommendations.")
+        future.set_exception(error)
+        # Mark the exception as retrieved in case nobody else awaited it
+        future.exception()
+        raise error
+    finally:
+        _in_flight.pop(key, None)
+        if not future.done():
+            future.cancel()  # leader cancelled; wake the followers
+
+
+async def recommend_courses_batch(items: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
+    """
+    Recommend courses for a whole roster of (course, marks) pairs.
+    Duplicate (course, band) pairs are generated once; the rest run
+    concurrently, at most recommendation_batch_concurrency at a time.
+    Per-item failures are reported in that item's `error` field.
+    """
+    semaphore = asyncio.Semaphore(settings.recommendation_batch_concurrency)
+    unique: Dict[Tuple[str, str], Tuple[str, float]] = {}
+    for course, marks in items:
+        unique.setdefault(_memo_key(course, marks), (course, marks))
+
+    async def run(course: str, marks: float):
+        async with semaphore:
+            return await recommend_courses(course, marks)
+
+    keys = list(unique.keys())
+    results = await asyncio.gather(
+        *(run(*unique[key]) for key in keys), return_exceptions=True
+    )
+    by_key = dict(zip(keys, results))
+
+    output = []
+    for course, marks in items:
+        result = by_key[_memo_key(course, marks)]
+        if isinstance(result, Exception):
+            detail = getattr(result, "detail", str(result))
+            output.append({"course": course, "marks": marks, "recommendations": None, "error": detail})
+        else:
+            output.append({"course": course, "marks": marks, "recommendations": result, "error": None})
+    return output
+
+
+def get_recommendation_stats() -> Dict[str, Any]:
+    now = time.time()
+    live = sum(1 for _, ts in _memo.values() if now - ts <= settings.recommendation_ttl_seconds)
+    return {"entries": live, "in_flight": len(_in_flight), **memo_stats}
@@ -1,18 +1,28 @@
 import os
 import shutil
 import uuid
-from fastapi import APIRouter, HTTPException, Body,UploadFile, File    # ← added Body here
+import dataclasses
+import json
+import time
+from fastapi import APIRouter, HTTPException, Body,UploadFile, File, Query, BackgroundTasks    # ← added Body here
 
 from typing import List
 import tempfile
-from typing import Optional
+from typing import Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
 from schemas import (
     IngestRequest,
     IngestResponse,
     CreateChatResponse,
     ChatRequest,
-    ChatResponse
+    ChatResponse,
+    IngestJobStatus,
+    RecommendationBatchRequest,
+    BulkQuizRequest,
+    QuizSpec,
+    SearchRequest,
 )
 from utils import (
     text_splitter,
@@ -22,94 +32,159 @@ from utils import (
     upsert_vectorstore_metadata,
     build_or_load_vectorstore,
     build_rag_chain,
-    initialize_chat_history
+    get_index_version,
+    heuristic_rewrite,
+    answer_rag_question,
+    stream_rag_answer,
+    LLMCallCounter,
+    CHAT_PIPELINE_MODES,
+    llm_call_stats,
+    record_llm_calls,
 )
+from config import settings
 from logging_config import logger
+from metrics import span
+from vectorstore_cache import vectorstore_cache
+from answer_cache import answer_cache
+from embedding_cache import get_cache_stats as get_embedding_cache_stats
+from embedding_batcher import get_batcher_stats
+from ingest import (
+    IngestError,
+    IngestJob,
+    QueueFullError,
+    SUPPORTED_SUFFIXES,
+    ingest_jobs,
+    run_ingest,
+)
 
 from chat_history import ChatHistoryManager
-from langchain.prompts import PromptTemplate
-from embeddings import get_llm
+from llm_client import set_llm_user
+from bulk_quiz import generate_quizzes
+from semantic_search import search_corpus
+from question_bank import (
+    get_question_bank,
+    normalize_difficulty,
+    normalize_question_type,
+    question_banks,
+    sample_questions,
+)
+from recommendations import (
+    recommend_courses,
+    recommend_courses_batch,
+    get_recommendation_stats,
+)
 
 
 router = APIRouter(prefix="/rag", tags=["rag"])
 
 from fastapi import HTTPException
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-from langchain_community.vectorstores import FAISS as _FAISS
+
+def _save_uploads(files: List[UploadFile]) -> List[Tuple[str, str]]:
+    """
+    Copy each upload to a temporary file and return (filename, temp path) pairs.
+    Rejects unsupported file types before anything is copied.
+    """
+    for upload in files:
+        suffix = os.path.splitext(upload.filename)[1].lower()
+        if suffix not in SUPPORTED_SUFFIXES:
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {upload.filename}")
+
+    uploads = []
+    with span("ingest.upload_copy"):
+        for upload in files:
+            suffix = os.path.splitext(upload.filename)[1].lower()
+            # Save upload to temporary file
+            try:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                    shutil.copyfileobj(upload.file, tmp)
+                    uploads.append((upload.filename, tmp.name))
+            finally:
+                upload.file.close()
+    return uploads
+
+def _job_status(job: IngestJob) -> IngestJobStatus:
+    return IngestJobStatus(**dataclasses.asdict(job))
 
 @router.post("/ingest/{user_id}", response_model=IngestResponse)
 async def ingest_documents(
     user_id: str,
     files: List[UploadFile] = File(...),
+    mode: str = Query("replace", description="'replace' rebuilds the index, 'append' adds to it"),
 ):
     """
     Ingest uploaded PDF or DOCX files into a FAISS vectorstore.
-    """
-    # 1. Extract text from each uploaded file
-    all_texts = []
-    for upload in files:
-        filename = upload.filename
-        suffix = os.path.splitext(filename)[1].lower()
-        # Save upload to temporary file
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                shutil.copyfileobj(upload.file, tmp)
-                tmp_path = tmp.name
-        finally:
-            upload.file.close()
 
-        try:
-            if suffix == ".pdf":
-                loader = PyPDFLoader(tmp_path, mode="page")
-                docs = loader.load()
-                all_texts.extend([d.page_content for d in docs])
+    With mode=replace the user's index is rebuilt from these uploads only;
+    with mode=append only the new chunks are embedded and added to it.
+    Every chunk records the file it came from in its `source` metadata.
+    The work runs in a thread so other requests are not blocked meanwhile.
+    It takes a slot of the ingest queue; returns 429 when the queue is full.
+    """
+    if mode not in ("replace", "append"):
+        raise HTTPException(status_code=400, detail=f"Unsupported ingest mode: {mode}")
 
-            elif suffix == ".docx":
-                loader = Docx2txtLoader(tmp_path)
-                docs = loader.load()
-                all_texts.extend([d.page_content for d in docs])
+    try:
+        with ingest_jobs.reserve():
+            uploads = await run_in_threadpool(_save_uploads, files)
+            result = await run_in_threadpool(run_ingest, user_id, uploads, mode)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await upsert_vectorstore_metadata(user_id, result["vectorstore_path"])
+    if settings.question_bank_enabled:
+        question_banks.schedule(user_id)
+    return IngestResponse(**result)
+
+@router.post("/ingest/{user_id}/jobs", response_model=IngestJobStatus, status_code=202)
+async def submit_ingest_job(
+    user_id: str,
+    files: List[UploadFile] = File(...),
+    mode: str = Query("replace", description="'replace' rebuilds the index, 'append' adds to it"),
+):
+    """
+    Queue an ingestion job and return its job_id immediately.
+    Poll GET /rag/ingest/jobs/{job_id} for status and progress.
+    Returns 429 when the ingest queue is full.
+    """
+    if mode not in ("replace", "append"):
+        raise HTTPException(status_code=400, detail=f"Unsupported ingest mode: {mode}")
 
-            else:
-                # unsupported file type
-                raise HTTPException(status_code=400, detail=f"Unsupported file type: {filename}")
-        finally:
-            # Clean up temp file
+    uploads = await run_in_threadpool(_save_uploads, files)
+    try:
+        job = ingest_jobs.submit(user_id, uploads, mode)
+    except QueueFullError as e:
+        for _, tmp_path in uploads:
             try:
                 os.remove(tmp_path)
             except OSError:
                 pass
+        raise HTTPException(status_code=429, detail=str(e))
+    return _job_status(job)
 
-    if not all_texts:
-        raise HTTPException(status_code=400, detail="No valid documents uploaded.")
-
-    # 2. Concatenate all extracted text
-    combined_text = "\n\n".join(all_texts)
-
-    # 3. Split into chunks
-    text_chunks = text_splitter.split_text(combined_text)
-
-    # 4. Build FAISS vectorstore
-    vs = _FAISS.from_texts(texts=text_chunks, embedding=embeddings)
-
-    # 5. Save to disk
-    faiss_path = save_vectorstore_to_disk(vs, user_id)
-
-    # 6. Upsert metadata
-    upsert_vectorstore_metadata(user_id, faiss_path)
+@router.get("/ingest/jobs/{job_id}", response_model=IngestJobStatus)
+async def get_ingest_job(job_id: str):
+    """
+    Return status and progress (pages parsed, chunks embedded) of an ingest job.
+    """
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingest job not found.")
+    return _job_status(job)
 
-    return IngestResponse(
-        success=True,
-        message="Vectorstore created successfully.",
-        user_id=user_id,
-        vectorstore_path=faiss_path
-    )
+@router.get("/ingest/jobs", response_model=List[IngestJobStatus])
+async def list_ingest_jobs(user_id: Optional[str] = Query(None)):
+    """
+    List known ingest jobs, optionally only those for one user.
+    """
+    return [_job_status(job) for job in ingest_jobs.list(user_id)]
 
 @router.post("/chat/create/{user_id}", response_model=CreateChatResponse)
 async def create_chat_session(user_id: str):
     """
     Create a new chat session for this user:
       - Generate a chat_id (UUID).
-      - Initialize an empty MongoDBChatMessageHistory for that chat_id.
+      - Initialize an empty chat session document for that chat_id.
       - Return the chat_id so the client can use it in subsequent calls.
     """
     logger.info("Creating new chat session for user_id=%s", user_id)
@@ -117,7 +192,7 @@ async def create_chat_session(user_id: str):
         chat_id = str(uuid.uuid4())
 
         # Initialize chat history (this writes an empty session to Mongo)
-        _ = initialize_chat_history(chat_id)
+        await ChatHistoryManager.create_session(chat_id)
         logger.info("Created chat history in Mongo for chat_id=%s", chat_id)
 
         return CreateChatResponse(
@@ -131,38 +206,104 @@ async def create_chat_session(user_id: str):
         raise HTTPException(status_code=500, detail=f"Failed to create chat session: {e}")
 
 
+def _pipeline_mode(body: ChatRequest) -> str:
+    mode = body.mode or settings.chat_pipeline_mode
+    if mode not in CHAT_PIPELINE_MODES:
+        raise HTTPException(status_code=400, detail=f"Unsupported chat pipeline mode: {mode}")
+    return mode
+
+class _AnswerCacheKey:
+    """Index version, query text and embedding used to look up / store a cached answer."""
+
+    def __init__(
+        self, user_id: str, version: Optional[int], vector: Optional[List[float]], text: str = ""
+    ):
+        self.user_id = user_id
+        self.version = version
+        self.vector = vector
+        self.text = text
+
+    def lookup(self) -> Optional[str]:
+        if self.version is None or self.vector is None:
+            return None
+        return answer_cache.lookup(self.user_id, self.version, self.vector, self.text)
+
+    def store(self, answer: str) -> None:
+        if self.version is not None and self.vector is not None:
+            answer_cache.store(self.user_id, self.version, self.vector, self.text, answer)
+
+async def _answer_cache_key(user_id: str, question: str, history: List[dict]) -> _AnswerCacheKey:
+    """
+    Embed the question for the semantic answer cache. Follow-up questions
+    are embedded together with the previous request, so "10 more" after
+    different topics does not collide.
+    """
+    if not settings.answer_cache_enabled:
+        return _AnswerCacheKey(user_id, None, None)
+    version = get_index_version(user_id)
+    if version is None:
+        return _AnswerCacheKey(user_id, None, None)
+    text = heuristic_rewrite(question, history)
+    with span("chat.query_embed"):
+        vector = await embeddings.aembed_query(text)
+    return _AnswerCacheKey(user_id, version, vector, text)
+
 @router.post("/chat/{user_id}/{chat_id}", response_model=ChatResponse)
-async def chat_with_user(user_id: str, chat_id: str, body: ChatRequest):
+async def chat_with_user(
+    user_id: str,
+    chat_id: str,
+    body: ChatRequest,
+    background_tasks: BackgroundTasks,
+):
     question = body.question.strip()
+    mode = _pipeline_mode(body)
     logger.info("Chat request user=%s chat=%s question=%s", user_id, chat_id, question)
+    set_llm_user(user_id)
 
     try:
-        # 1) Ensure session exists
-        ChatHistoryManager.create_session(chat_id)
-
-        # 2) Summarize long histories
-        ChatHistoryManager.summarize_if_needed(chat_id, threshold=10)
-
-        # 3) Record the user message
-        ChatHistoryManager.add_message(chat_id, role="human", content=question)
-
-        # 4) Build and invoke the RAG chain
-        chain = build_rag_chain(user_id, chat_id)
-        history = ChatHistoryManager.get_messages(chat_id)
-        result = chain.invoke({"question": question, "chat_history": history})
-        answer = result.get("answer") or result.get("output_text")
-        if not answer:
-            raise Exception("No answer returned from chain")
+        # 1) Ensure session exists, record the user message and load recent history
+        history, message_count = await ChatHistoryManager.append_and_load(
+            chat_id, role="human", content=question, window=settings.chat_history_window
+        )
 
-        # 5) Record the AI response
-        ChatHistoryManager.add_message(chat_id, role="ai", content=answer)
+        # 2) Serve near-identical repeat requests from the answer cache,
+        #    otherwise build and run the RAG chain (history excludes the question itself)
+        counter = LLMCallCounter()
+        context_report = {}
+        cache_key = await _answer_cache_key(user_id, question, history[:-1])
+        answer = cache_key.lookup()
+        cached = answer is not None
+        if not cached:
+            chain = await run_in_threadpool(build_rag_chain, user_id, chat_id)
+            answer = await answer_rag_question(
+                chain, question, history[:-1], mode=mode, callbacks=[counter],
+                context_report=context_report,
+            )
+            record_llm_calls(mode, counter.calls)
+            if not answer:
+                raise Exception("No answer returned from chain")
+            cache_key.store(answer)
+
+        # 3) Record the AI response
+        await ChatHistoryManager.add_message(chat_id, role="ai", content=answer)
+
+        # 4) Fold long histories into the rolling summary after responding
+        background_tasks.add_task(
+            ChatHistoryManager.summarize_if_needed,
+            chat_id,
+            threshold=settings.chat_summary_threshold,
+            message_count=message_count + 1,
+        )
 
         return ChatResponse(
             success=True,
             answer=answer,
             error=None,
             chat_id=chat_id,
-            user_id=user_id
+            user_id=user_id,
+            llm_calls=counter.calls,
+            cached=cached,
+            context_tokens_saved=context_report.get("saved_tokens"),
         )
 
     except HTTPException:
@@ -177,29 +318,251 @@ async def chat_with_user(user_id: str, chat_id: str, body: ChatRequest):
             user_id=user_id
         )
     
-def recommend_courses(course: str, marks: float) -> str:
+async def _single(text: str):
+    yield text
+
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    """Format one server-sent event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@router.post("/chat/{user_id}/{chat_id}/stream")
+async def chat_with_user_stream(user_id: str, chat_id: str, body: ChatRequest):
+    """
+    Streaming variant of /rag/chat/{user_id}/{chat_id} using server-sent events.
+
+    Emits `data: {"token": ...}` events as tokens arrive from the LLM, then a
+    final `event: done` with the full answer and timings (ttft_ms, total_ms),
+    or `event: error` if generation fails. The answer is saved to chat history
+    once the stream completes.
     """
-    Recommend three next-step courses based on the completed `course` and `marks`.
+    question = body.question.strip()
+    mode = _pipeline_mode(body)
+    logger.info("Streaming chat request user=%s chat=%s question=%s", user_id, chat_id, question)
+    set_llm_user(user_id)
+
+    history, message_count = await ChatHistoryManager.append_and_load(
+        chat_id, role="human", content=question, window=settings.chat_history_window
+    )
+    history = history[:-1]
+
+    cache_key = await _answer_cache_key(user_id, question, history)
+    cached_answer = cache_key.lookup()
+
+    # Raises 404 before the stream starts if the user has no vectorstore
+    chain = None
+    if cached_answer is None:
+        chain = await run_in_threadpool(build_rag_chain, user_id, chat_id)
+
+    # Summarization is queued only once the answer has been saved
+    background = BackgroundTasks()
+
+    async def event_stream():
+        start = time.perf_counter()
+        ttft_ms = None
+        parts = []
+        counter = LLMCallCounter()
+        context_report = {}
+        try:
+            if cached_answer is not None:
+                tokens = _single(cached_answer)
+            else:
+                tokens = stream_rag_answer(
+                    chain, question, history, mode=mode, callbacks=[counter], context_report=context_report
+                )
+            async for token in tokens:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                    logger.info("Time to first token user=%s chat=%s: %.1f ms", user_id, chat_id, ttft_ms)
+                parts.append(token)
+                yield _sse({"token": token})
+
+            answer = "".join(parts)
+            if not answer:
+                raise Exception("No answer returned from chain")
+            if cached_answer is None:
+                record_llm_calls(mode, counter.calls)
+                cache_key.store(answer)
+
+            await ChatHistoryManager.add_message(chat_id, role="ai", content=answer)
+            background.add_task(
+                ChatHistoryManager.summarize_if_needed,
+                chat_id,
+                threshold=settings.chat_summary_threshold,
+                message_count=message_count + 1,
+            )
+
+            total_ms = (time.perf_counter() - start) * 1000
+            yield _sse({
+                "answer": answer,
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "ttft_ms": ttft_ms,
+                "total_ms": total_ms,
+                "llm_calls": counter.calls,
+                "cached": cached_answer is not None,
+                "context_tokens_saved": context_report.get("saved_tokens"),
+            }, event="done")
+        except Exception as e:
+            logger.error("Error streaming chat user=%s chat=%s: %s", user_id, chat_id, e, exc_info=True)
+            yield _sse({"error": str(e), "chat_id": chat_id, "user_id": user_id}, event="error")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background,
+    )
+
+@router.post("/quiz/bulk/{user_id}")
+async def generate_quizzes_bulk(user_id: str, body: BulkQuizRequest):
     """
-    template = """
-    You are an academic advisor. A student just completed the course "{course}"
-    with a score of {marks}%. Recommend three specific next-step university
-    or online courses, and briefly explain why each is a good fit given their performance.
-    in the output only provide the course names, separated by commas.
-    Do not include any other text or explanations.
-    Example output:
-    "Advanced Physics, Data Science Fundamentals, Machine Learning Basics"
+    Endpoint: POST /rag/quiz/bulk/{user_id}
+    Body JSON:
+    {
+      "items": [
+        {"topic": "Decision trees", "quiz_type": "multiple-choice", "difficulty": "hard", "num_questions": 10},
+        {"topic": "Overfitting", "quiz_type": "true/false", "difficulty": "easy", "num_questions": 5}
+      ],
+      "k": 5
+    }
+    Streams server-sent events: one `data:` event per quiz as it completes
+    (with its `index` in the request, `success`, `quiz` and `error`), then
+    `event: done` with counts and total_ms. Topics share one batched
+    retrieval; generation runs bulk_quiz_concurrency LLM calls at a time.
     """
-    prompt = PromptTemplate.from_template(template)
-    prompt_text = prompt.format(course=course, marks=marks)
+    if len(body.items) > settings.bulk_quiz_max_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.bulk_quiz_max_items} quizzes per request.",
+        )
+    try:
+        vectorstore = await run_in_threadpool(build_or_load_vectorstore, user_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Vectorstore not found for this user. Call /rag/ingest first.")
 
-    llm = get_llm()
+    logger.info("Bulk quiz request user=%s items=%d", user_id, len(body.items))
+    set_llm_user(user_id)
+
+    async def event_stream():
+        start = time.perf_counter()
+        succeeded = failed = 0
+        try:
+            async for result in generate_quizzes(vectorstore, body.items, body.k):
+                if result["success"]:
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield _sse(result)
+            yield _sse({
+                "user_id": user_id,
+                "succeeded": succeeded,
+                "failed": failed,
+                "total_ms": (time.perf_counter() - start) * 1000,
+            }, event="done")
+        except Exception as e:
+            logger.error("Error in bulk quiz generation user=%s: %s", user_id, e, exc_info=True)
+            yield _sse({"error": str(e), "user_id": user_id}, event="error")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/search/{user_id}")
+async def search_documents(user_id: str, body: SearchRequest):
+    """
+    Endpoint: POST /rag/search/{user_id}
+    Body JSON:
+    {"queries": ["What is overfitting?", "Define entropy."], "k": 5}
+    Returns, per query and in request order, the top-k chunks with their
+    similarity score, source file and metadata. All queries are embedded in
+    one batch and searched with one FAISS call; the LLM and chat history
+    are not involved. The response reports queries_per_second.
+    """
+    if len(body.queries) > settings.search_max_queries:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.search_max_queries} queries per request.",
+        )
     try:
-        # invoke() may vary depending on your LLM wrapper (e.g. .generate, .predict, etc.)
-        return llm.invoke(prompt_text)
-    except Exception as e:
-        logger.error(f"Course recommendation error: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Could not generate course recommendations.")
+        vectorstore = await run_in_threadpool(build_or_load_vectorstore, user_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Vectorstore not found for this user. Call /rag/ingest first.")
+
+    result = await search_corpus(vectorstore, body.queries, body.k)
+    return {"user_id": user_id, "k": body.k, **result}
+
+@router.post("/quiz/bank/{user_id}/build", status_code=202)
+async def start_question_bank_build(user_id: str):
+    """
+    Endpoint: POST /rag/quiz/bank/{user_id}/build
+    Start (or queue) a background build of the user's question bank, as
+    done after every ingest when QUESTION_BANK_ENABLED is set. Sections
+    already in the bank are reused. Poll GET /rag/quiz/bank/{user_id}.
+    """
+    if get_index_version(user_id) is None:
+        raise HTTPException(status_code=404, detail="Vectorstore not found for this user. Call /rag/ingest first.")
+    return {"user_id": user_id, "build": question_banks.schedule(user_id)}
+
+@router.get("/quiz/bank/{user_id}")
+async def get_question_bank_status(user_id: str):
+    """
+    Endpoint: GET /rag/quiz/bank/{user_id}
+    Returns the state of the latest build (if any) and question counts
+    per type and difficulty of the saved bank.
+    """
+    bank = await run_in_threadpool(get_question_bank, user_id)
+    return {
+        "user_id": user_id,
+        "build": question_banks.status(user_id),
+        "bank": bank.stats() if bank is not None else None,
+    }
+
+@router.post("/quiz/bank/{user_id}/sample")
+async def sample_quiz_from_bank(user_id: str, body: QuizSpec):
+    """
+    Endpoint: POST /rag/quiz/bank/{user_id}/sample
+    Body JSON:
+    {"topic": "Decision trees", "quiz_type": "multiple-choice", "difficulty": "hard", "num_questions": 10}
+    Serves a quiz from the precomputed question bank: the questions closest
+    to the topic with that type and difficulty, sampled so repeated quizzes
+    vary. No LLM call is made; fewer questions are returned if the bank
+    does not hold enough.
+    """
+    quiz_type = normalize_question_type(body.quiz_type)
+    difficulty = normalize_difficulty(body.difficulty)
+    if quiz_type is None or difficulty is None:
+        raise HTTPException(
+            status_code=400,
+            detail="The question bank holds multiple-choice, true/false and short answer questions "
+                   "at easy, medium and hard difficulty.",
+        )
+    bank = await run_in_threadpool(get_question_bank, user_id)
+    if bank is None:
+        raise HTTPException(
+            status_code=404,
+            detail="No question bank for this user yet. Call /rag/quiz/bank/{user_id}/build after ingesting.",
+        )
+    questions = await sample_questions(bank, body.topic, quiz_type, difficulty, body.num_questions)
+    return {
+        "user_id": user_id,
+        "topic": body.topic,
+        "quiz_type": quiz_type,
+        "difficulty": difficulty,
+        "requested": body.num_questions,
+        "returned": len(questions),
+        "questions": questions,
+    }
+
+@router.get("/chat/stats")
+async def get_chat_stats():
+    """
+    Endpoint: GET /rag/chat/stats
+    Returns chat turns and LLM calls made, per chat pipeline mode.
+    """
+    return {"default_mode": settings.chat_pipeline_mode, "modes": llm_call_stats}
 
 @router.post("/recommendations")
 async def get_course_recommendations(
@@ -215,9 +578,44 @@ async def get_course_recommendations(
     }
     Returns LLM-generated list of three recommended courses.
     """
-    recommendations = recommend_courses(course, marks)
+    recommendations = await recommend_courses(course, marks)
     return {"recommendations": recommendations}
 
+@router.post("/recommendations/batch")
+async def get_course_recommendations_batch(body: RecommendationBatchRequest):
+    """
+    Endpoint: POST /rag/recommendations/batch
+    Body JSON:
+    {
+      "items": [
+        {"course": "Physics 101", "marks": 85.5},
+        {"course": "Chemistry 101", "marks": 62}
+      ]
+    }
+    Returns one result per item, in order. Identical (course, score band)
+    pairs share one LLM call and distinct ones run concurrently.
+    """
+    results = await recommend_courses_batch([(i.course, i.marks) for i in body.items])
+    return {"results": results}
+
+def collect_cache_stats() -> dict:
+    """Hit/miss/eviction counters of every cache, for /rag/cache/stats and /metrics."""
+    return {
+        "vectorstore_cache": vectorstore_cache.stats(),
+        "embedding_cache": get_embedding_cache_stats(embeddings),
+        "embedding_batcher": get_batcher_stats(embeddings),
+        "answer_cache": answer_cache.stats(),
+        "recommendations": get_recommendation_stats(),
+    }
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Endpoint: GET /rag/cache/stats
+    Returns hit/miss/eviction counters for the vectorstore and embedding caches.
+    """
+    return collect_cache_stats()
+
 @router.get("/")
 async def Welcome():
     """
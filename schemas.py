@@ -18,6 +18,25 @@ class IngestResponse(BaseModel):
     message: str
     user_id: str
     vectorstore_path: Optional[str] = None
+    chunks_added: Optional[int] = None
+
+class IngestJobStatus(BaseModel):
+    """
+    Status and progress of a background ingestion job.
+    """
+    job_id: str
+    user_id: str
+    mode: str
+    status: str
+    files_total: int = 0
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    error: Optional[str] = None
+    result: Optional[IngestResponse] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 class CreateChatResponse(BaseModel):
     """
@@ -33,6 +52,10 @@ class ChatRequest(BaseModel):
     Body for sending a user message to an existing chat session.
     """
     question: str = Field(..., description="The user's question or message.")
+    mode: Optional[str] = Field(
+        None,
+        description="Chat pipeline mode: 'condense', 'heuristic' or 'raw' (defaults to the server setting)."
+    )
 
 class ChatResponse(BaseModel):
     """
@@ -43,3 +66,47 @@ class ChatResponse(BaseModel):
     error: Optional[str] = None
     chat_id: str
     user_id: str
+    llm_calls: Optional[int] = None
+    cached: bool = False
+    context_tokens_saved: Optional[int] = Field(
+        None,
+        description="Prompt tokens saved by context packing versus stuffing the top-k chunks (0 if none)."
+    )
+
+class RecommendationItem(BaseModel):
+    """
+    One (course, marks) pair for course recommendations.
+    """
+    course: str = Field(..., description="Name of the completed course")
+    marks: float = Field(..., description="Score achieved in that course (percentage)")
+
+class RecommendationBatchRequest(BaseModel):
+    """
+    Body for requesting recommendations for a whole class roster at once.
+    """
+    items: List[RecommendationItem] = Field(..., description="(course, marks) pairs, e.g. one per student.")
+
+class QuizSpec(BaseModel):
+    """
+    One quiz to generate in a bulk request: a topic (or section) plus the
+    quiz type, difficulty and number of questions.
+    """
+    topic: str = Field(..., min_length=1, description="Topic or section the quiz should cover.")
+    quiz_type: str = Field("multiple-choice", description="e.g. 'multiple-choice', 'true/false', 'short answer', 'Long Questions'.")
+    difficulty: str = Field("medium", description="'easy', 'medium' or 'hard'.")
+    num_questions: int = Field(10, ge=1, le=50, description="Number of questions in the quiz.")
+
+class BulkQuizRequest(BaseModel):
+    """
+    Body for generating many quizzes from a user's documents in one request.
+    """
+    items: List[QuizSpec] = Field(..., min_length=1, description="One spec per quiz to generate.")
+    k: int = Field(5, ge=1, le=50, description="Chunks retrieved as context for each topic.")
+
+class SearchRequest(BaseModel):
+    """
+    Body for retrieval-only search over a user's documents: many queries,
+    each answered with its top-k chunks.
+    """
+    queries: List[str] = Field(..., min_length=1, description="Search queries, e.g. existing exam questions.")
+    k: int = Field(5, ge=1, le=100, description="Chunks returned per query.")
@@ -0,0 +1,56 @@
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from langchain_community.vectorstores import FAISS
+
+from embeddings import embeddings
+from faiss_index import search_many
+from metrics import metrics, span
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Retrieval-only search: many queries, one embedding batch, one matrix search
+# ──────────────────────────────────────────────────────────────────────────────
+
+def format_hits(hits: List) -> List[Dict[str, Any]]:
+    """
+    (document, L2 distance) pairs as response items. Embeddings are
+    normalized, so the squared L2 distance d gives cosine similarity 1 - d / 2.
+    """
+    return [
+        {
+            "rank": rank,
+            "score": round(1.0 - distance / 2, 6),
+            "distance": round(distance, 6),
+            "text": doc.page_content,
+            "source": doc.metadata.get("source"),
+            "metadata": doc.metadata,
+        }
+        for rank, (doc, distance) in enumerate(hits, start=1)
+    ]
+
+
+async def search_corpus(vectorstore: FAISS, queries: List[str], k: int) -> Dict[str, Any]:
+    """
+    Top-k chunks of `vectorstore` for every query, in request order. All
+    queries are embedded in one batch and searched with a single FAISS
+    matrix search; no LLM call is made. Timings and the queries-per-second
+    throughput of this call are included in the result.
+    """
+    started = time.perf_counter()
+    with span("search.embed"):
+        vectors = await embeddings.aembed_queries(queries)
+    embedded = time.perf_counter()
+    with span("search.retrieve"):
+        hits = await asyncio.to_thread(search_many, vectorstore, vectors, k)
+    finished = time.perf_counter()
+    metrics.incr("search.queries", len(queries))
+
+    seconds = finished - started
+    return {
+        "results": [{"query": q, "hits": format_hits(h)} for q, h in zip(queries, hits)],
+        "embed_ms": round((embedded - started) * 1000, 3),
+        "search_ms": round((finished - embedded) * 1000, 3),
+        "total_ms": round(seconds * 1000, 3),
+        "queries_per_second": round(len(queries) / seconds, 1) if seconds else None,
+    }
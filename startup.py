@@ -0,0 +1,55 @@
+import time
+from typing import Any, Dict
+
+import db
+from config import settings
+from embeddings import embeddings
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Startup timings, warmup and readiness
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Seconds spent in each startup phase (import, warmup steps), reported by /ready
+startup_timings: Dict[str, float] = {}
+
+_mongo_reachable = False
+
+
+def record_timing(name: str, started: float) -> None:
+    startup_timings[name] = round(time.perf_counter() - started, 4)
+    logger.info("Startup phase %s took %.3fs", name, startup_timings[name])
+
+
+def warmup_embeddings() -> None:
+    """Load the embedding model and run one forward pass (blocking)."""
+    started = time.perf_counter()
+    embeddings.embed_query("warmup")
+    record_timing("warmup_embeddings", started)
+
+
+async def warmup_mongo() -> None:
+    """Create the Mongo client and check the server answers."""
+    global _mongo_reachable
+    started = time.perf_counter()
+    try:
+        await db.get_mongo_client().admin.command("ping")
+        _mongo_reachable = True
+    except Exception as e:
+        logger.warning("Mongo warmup ping failed: %s", e)
+    record_timing("warmup_mongo", started)
+
+
+def resource_status() -> Dict[str, Any]:
+    """Which heavy resources are loaded, plus startup timings."""
+    resources = {
+        "embeddings_model": embeddings.loaded,
+        "mongo_client": db._mongo_client is not None,
+        "mongo_reachable": _mongo_reachable,
+    }
+    return {
+        "ready": embeddings.loaded or not settings.warmup_on_startup,
+        "warmup_on_startup": settings.warmup_on_startup,
+        "resources": resources,
+        "timings": dict(startup_timings),
+    }
@@ -1,16 +1,35 @@
 import os
-from typing import Optional, Dict, Any
+import re
+import time
+from typing import Optional, Dict, Any, List, AsyncIterator, Callable, Tuple
 from fastapi import HTTPException
 
+import faiss
+
 from langchain_community.vectorstores import FAISS
-from langchain_mongodb.chat_message_histories import MongoDBChatMessageHistory
-from langchain.memory import ConversationBufferMemory                # ← IMPORT THIS
 from langchain.chains import ConversationalRetrievalChain
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
 
 from config import settings
-from db import vectorstore_meta_coll, chat_collection_name
+from db import get_vectorstore_meta_collection
 from embeddings import embeddings, text_splitter, user_prompt, get_llm
 from logging_config import logger
+from metrics import record, span
+from vectorstore_cache import vectorstore_cache
+from answer_cache import answer_cache
+from faiss_index import (
+    apply_index_type,
+    configure_search_params,
+    flat_contents,
+    read_faiss_index,
+    read_index_meta,
+    write_index_meta,
+)
+from chunk_store import has_chunk_store, iter_documents, load_chunk_store, write_chunk_store
+from index_store import publish_version, read_generation, version_dir
+from context_packing import pack_retrieved_context
+from bm25_index import HybridRetriever, get_bm25_index, write_bm25_index
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 1. Helper: Path to Store (or Load) a User's FAISS Vectorstore on Disk
@@ -30,20 +49,101 @@ def get_vectorstore_path(user_id: str) -> str:
 # ──────────────────────────────────────────────────────────────────────────────
 def build_or_load_vectorstore(user_id: str) -> FAISS:
     """
-    Attempt to load an existing FAISS index for this user.
+    Return the FAISS index for this user, served from the in-process cache
+    when possible and loaded from disk otherwise. The cached copy is only
+    used while it is still the published generation, so a version saved by
+    another worker is picked up on the next call.
     If not found on disk, raise a FileNotFoundError.
     """
+    return build_or_load_vectorstore_version(user_id)[1]
+
+
+def build_or_load_vectorstore_version(user_id: str) -> Tuple[int, FAISS]:
+    """
+    Same as build_or_load_vectorstore, but also return the generation the
+    index was loaded from, for files saved next to it (BM25 index).
+    """
+    return _load_published(
+        user_id,
+        lambda generation: (
+            generation,
+            vectorstore_cache.get_or_load(
+                user_id, lambda: load_index_version(user_id, generation), generation=generation
+            ),
+        ),
+    )
+
+
+def load_vectorstore_from_disk(user_id: str, writable: bool = False) -> FAISS:
+    """
+    Load the published FAISS index for this user from disk, bypassing the cache.
+    If not found on disk, raise a FileNotFoundError.
+    """
+    return _load_published(
+        user_id, lambda generation: load_index_version(user_id, generation, writable)
+    )
+
+
+def _load_published(user_id: str, load: Callable[[int], Any]) -> Any:
+    """
+    Call load(generation) for the published generation. A writer in another
+    worker may publish and prune that version between reading CURRENT and
+    loading it, so a FileNotFoundError is retried once with a fresh generation.
+    """
     user_dir = get_vectorstore_path(user_id)
-    faiss_index_path = os.path.join(user_dir, "faiss_index")
+    generation = read_generation(user_dir)
+    for attempt in range(2):
+        if generation is None:
+            raise FileNotFoundError(f"No vectorstore found for user {user_id}")
+        try:
+            return load(generation)
+        except FileNotFoundError:
+            latest = read_generation(user_dir)
+            if attempt or latest == generation:
+                raise
+            logger.info(
+                "Index version %d of user_id=%s was pruned, reloading version %s",
+                generation, user_id, latest,
+            )
+            generation = latest
+
+
+def load_index_version(user_id: str, generation: int, writable: bool = False) -> FAISS:
+    """
+    Load one saved version of the user's FAISS index.
+
+    Chunk text is served lazily from the memory-mapped chunk store, and the
+    index itself is memory-mapped read-only (settings.faiss_mmap) unless
+    `writable` is set, so loading does not depend on corpus size and
+    workers share pages through the OS page cache. Indexes saved before
+    the chunk store existed are still loaded from their pickled docstore.
+    """
+    faiss_index_path = version_dir(get_vectorstore_path(user_id), generation)
 
     if not os.path.isdir(faiss_index_path):
         raise FileNotFoundError(f"No vectorstore found at {faiss_index_path}")
 
-    # Allow loading your own index via pickle
-    return FAISS.load_local(
-        folder_path=faiss_index_path,
-        embeddings=embeddings,
-        allow_dangerous_deserialization=True
+    if not has_chunk_store(faiss_index_path):
+        # Legacy layout: allow loading your own index via pickle
+        vectorstore = FAISS.load_local(
+            folder_path=faiss_index_path,
+            embeddings=embeddings,
+            allow_dangerous_deserialization=True
+        )
+        configure_search_params(vectorstore.index)
+        return vectorstore
+
+    index = read_faiss_index(
+        os.path.join(faiss_index_path, "index.faiss"),
+        mmap=settings.faiss_mmap and not writable,
+    )
+    configure_search_params(index)
+    docstore, index_to_docstore_id = load_chunk_store(faiss_index_path)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
     )
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -51,83 +151,150 @@ def build_or_load_vectorstore(user_id: str) -> FAISS:
 # ──────────────────────────────────────────────────────────────────────────────
 def save_vectorstore_to_disk(vectorstore: FAISS, user_id: str) -> str:
     """
-    Save the FAISS vectorstore under './vectorstores/{user_id}/faiss_index'.
-    Returns the path to that saved folder.
+    Save the FAISS vectorstore as a new version under
+    './vectorstores/{user_id}/versions/', publish it (see index_store) and
+    swap it into the in-process cache. A flat index is first converted
+    to the configured (or auto-selected, by size) index type, which is
+    recorded in index_meta.json.
+    The caller must hold index_store.user_write_lock for this user.
+    Returns the path to the new version folder.
     """
     user_dir = get_vectorstore_path(user_id)
-    faiss_index_path = os.path.join(user_dir, "faiss_index")
-    os.makedirs(faiss_index_path, exist_ok=True)
-    vectorstore.save_local(folder_path=faiss_index_path)
-    return faiss_index_path
+    vectorstore = apply_index_type(vectorstore)
+
+    def write(folder: str) -> None:
+        write_chunk_store(
+            folder,
+            iter_documents(vectorstore.docstore, vectorstore.index_to_docstore_id, vectorstore.index.ntotal),
+        )
+        if settings.hybrid_retrieval_enabled:
+            with span("ingest.lexical_index"):
+                write_bm25_index(
+                    folder,
+                    (doc.page_content for doc in iter_documents(
+                        vectorstore.docstore, vectorstore.index_to_docstore_id, vectorstore.index.ntotal
+                    )),
+                )
+        faiss.write_index(vectorstore.index, os.path.join(folder, "index.faiss"))
+        write_index_meta(folder, vectorstore.index)
+
+    generation, folder = publish_version(user_dir, write)
+
+    # Cache the memory-mapped copy rather than the in-memory one just built
+    vectorstore_cache.put(user_id, load_index_version(user_id, generation), generation=generation)
+    answer_cache.invalidate_user(user_id)
+    return folder
+
+def get_index_version(user_id: str) -> Optional[int]:
+    """
+    Cheap version stamp of the user's saved index (its published generation),
+    or None if the user has no index. Changes whenever the index is re-saved,
+    by this worker or another.
+    """
+    return read_generation(os.path.join(settings.vectorstore_base_path, user_id))
+
+def append_to_vectorstore(user_id: str, new_vectorstore: FAISS) -> FAISS:
+    """
+    Add the chunks of `new_vectorstore` (a freshly built flat index) to the
+    user's existing FAISS index, or return it unchanged if the user has none
+    yet. Vectors are added to the existing index whatever its type, so
+    trained IVF/quantized indexes keep their structure. The on-disk copy is
+    loaded fresh (not the cached one) so readers never see it mutated.
+    """
+    try:
+        vectorstore = load_vectorstore_from_disk(user_id, writable=True)
+    except FileNotFoundError:
+        return new_vectorstore
+
+    texts, vectors, metadatas = flat_contents(new_vectorstore)
+    vectorstore.add_embeddings(
+        text_embeddings=list(zip(texts, vectors.tolist())), metadatas=metadatas
+    )
+    return vectorstore
+
+def build_vectorstore_from_embeddings(
+    texts: List[str],
+    vectors: List[List[float]],
+    metadatas: List[Dict[str, Any]],
+) -> FAISS:
+    """
+    Build a new FAISS vectorstore from already-embedded `texts`.
+    """
+    return FAISS.from_embeddings(
+        text_embeddings=list(zip(texts, vectors)),
+        embedding=embeddings,
+        metadatas=metadatas,
+    )
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 4. Upsert or Fetch Vectorstore Metadata in MongoDB
 # ──────────────────────────────────────────────────────────────────────────────
-def upsert_vectorstore_metadata(user_id: str, vectorstore_path: str) -> None:
+async def upsert_vectorstore_metadata(user_id: str, vectorstore_path: str) -> None:
     """
-    Insert or update a document mapping user_id → vectorstore_path in MongoDB.
+    Insert or update a document mapping user_id → vectorstore_path in MongoDB,
+    along with the index type and size recorded in index_meta.json.
     """
-    vectorstore_meta_coll.update_one(
-        {"user_id": user_id},
-        {"$set": {"vectorstore_path": vectorstore_path}},
-        upsert=True
-    )
+    fields: Dict[str, Any] = {"vectorstore_path": vectorstore_path}
+    index_meta = read_index_meta(vectorstore_path)
+    if index_meta:
+        fields["index"] = index_meta
+    with span("ingest.metadata_upsert"):
+        await get_vectorstore_meta_collection().update_one(
+            {"user_id": user_id},
+            {"$set": fields},
+            upsert=True
+        )
 
-def get_vectorstore_metadata(user_id: str) -> Optional[Dict[str, Any]]:
+async def get_vectorstore_metadata(user_id: str) -> Optional[Dict[str, Any]]:
     """
     Retrieve the metadata doc (if any) for this user_id.
     """
-    return vectorstore_meta_coll.find_one({"user_id": user_id})
+    return await get_vectorstore_meta_collection().find_one({"user_id": user_id})
 
 # ──────────────────────────────────────────────────────────────────────────────
-# 5. Initialize (or Return) a MongoDBChatMessageHistory for chat_id
+# 5. Build a ConversationalRetrievalChain (RAG Chain) for user_id + chat_id
 # ──────────────────────────────────────────────────────────────────────────────
-def initialize_chat_history(chat_id: str) -> MongoDBChatMessageHistory:
+def format_chat_history(messages: List[Dict[str, Any]]) -> str:
     """
-    Create and return a MongoDBChatMessageHistory for the given chat_id.
+    Flatten stored {type, content} messages into "Human: ..." / "Assistant: ..." lines.
     """
-    return MongoDBChatMessageHistory(
-        session_id=chat_id,
-        connection_string=settings.mongo_uri,
-        database_name=settings.mongo_chat_db,
-        collection_name=chat_collection_name,
-    )
+    lines = []
+    for m in messages:
+        role = "Human" if m.get("type") in ("human", "user") else "Assistant"
+        lines.append(f"{role}: {m.get('content', '')}")
+    return "\n".join(lines)
 
-# ──────────────────────────────────────────────────────────────────────────────
-# 6. Build a ConversationalRetrievalChain (RAG Chain) for user_id + chat_id
-# ──────────────────────────────────────────────────────────────────────────────
 def build_rag_chain(user_id: str, chat_id: str) -> ConversationalRetrievalChain:
     """
     - Loads the FAISS index for user_id.
-    - Creates a retriever (k=3).
-    - Wraps MongoDBChatMessageHistory in a ConversationBufferMemory.
+    - Creates a hybrid vector + BM25 retriever (k=5).
     - Attaches the ChatGroq LLM + user_prompt.
+
+    The chain has no memory of its own: callers pass `chat_history` (the
+    {type, content} messages kept by ChatHistoryManager) on every call.
     """
     # 1. Load FAISS index (or 404 if not found)
     try:
-        faiss_vs = build_or_load_vectorstore(user_id)
+        with span("chat.index_load"):
+            generation, faiss_vs = build_or_load_vectorstore_version(user_id)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Vectorstore not found for this user. Call /rag/ingest first.")
 
-    retriever = faiss_vs.as_retriever(search_kwargs={"k": 5})
+    # Vector search fused with the BM25 index saved at ingest (if any)
+    lexical_index = None
+    if settings.hybrid_retrieval_enabled:
+        # From the same version as faiss_vs, so BM25 doc ids match its rows
+        lexical_index = get_bm25_index(version_dir(get_vectorstore_path(user_id), generation))
+    retriever = HybridRetriever(vectorstore=faiss_vs, search_kwargs={"k": 5}, lexical_index=lexical_index)
 
-    # 2. Instantiate a MongoDB-based chat history
-    chat_history = initialize_chat_history(chat_id)
-
-    # 3. Wrap that history in a ConversationBufferMemory, so the chain gets a valid "Memory" object
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",    # how the chain will reference the stored chat messages
-        chat_history=chat_history     # THIS tells the memory to use your MongoDB store
-    )
-
-    # 4. Get the LLM
+    # 2. Get the LLM
     llm = get_llm()
 
-    # 5. Build the ConversationalRetrievalChain with the wrapped memory
+    # 3. Build the ConversationalRetrievalChain over the caller-supplied history
     chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
         retriever=retriever,
-        memory=memory,                             # ← pass the ConversationBufferMemory here
+        get_chat_history=format_chat_history,
         return_source_documents=False,
         chain_type="stuff",
         combine_docs_chain_kwargs={"prompt": user_prompt},
@@ -135,3 +302,155 @@ def build_rag_chain(user_id: str, chat_id: str) -> ConversationalRetrievalChain:
     )
     return chain
 
+# ──────────────────────────────────────────────────────────────────────────────
+# 6. Run a chat turn: resolve the question, retrieve, generate (or stream)
+# ──────────────────────────────────────────────────────────────────────────────
+CHAT_PIPELINE_MODES = ("condense", "heuristic", "raw")
+
+# Words that suggest a question only makes sense alongside the previous one
+_FOLLOW_UP_WORDS = {
+    "it", "its", "this", "that", "these", "those", "them", "they",
+    "more", "another", "same", "again", "above", "previous", "similar",
+}
+# Questions of at most this many words ("why?", "10 more", "harder ones") are
+# treated as follow-ups even without one of the words above
+_BARE_FOLLOW_UP_MAX_WORDS = 2
+
+class LLMCallCounter(BaseCallbackHandler):
+    """Callback handler that counts LLM calls made during one chat turn."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self.calls += 1
+
+    def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self.calls += 1
+
+# Aggregate per-mode counters, exposed at GET /rag/chat/stats
+llm_call_stats: Dict[str, Dict[str, int]] = {
+    mode: {"turns": 0, "llm_calls": 0} for mode in CHAT_PIPELINE_MODES
+}
+
+def record_llm_calls(mode: str, calls: int) -> None:
+    stats = llm_call_stats.setdefault(mode, {"turns": 0, "llm_calls": 0})
+    stats["turns"] += 1
+    stats["llm_calls"] += calls
+
+def heuristic_rewrite(question: str, chat_history: List[Dict[str, Any]]) -> str:
+    """
+    Cheap local stand-in for LLM question condensing: if the question looks
+    like a follow-up (a word or two, or uses words like "it"/"more"/"same"), attach
+    the previous human request so retrieval and generation see both.
+    """
+    last_human = next(
+        (m.get("content", "") for m in reversed(chat_history) if m.get("type") in ("human", "user")),
+        None,
+    )
+    if not last_human:
+        return question
+    words = re.findall(r"[a-z0-9']+", question.lower())
+    if len(words) > _BARE_FOLLOW_UP_MAX_WORDS and not (set(words) & _FOLLOW_UP_WORDS):
+        return question
+    return f"{question}\n(Follow-up to: {last_human})"
+
+async def resolve_question(
+    chain: ConversationalRetrievalChain,
+    question: str,
+    chat_history: List[Dict[str, Any]],
+    mode: str,
+    callbacks: Optional[List[BaseCallbackHandler]] = None,
+) -> str:
+    """
+    Turn the user's question into the one used for retrieval and generation:
+      - "condense":  ask the LLM to rewrite it against the history (extra LLM call)
+      - "heuristic": local follow-up detection, no LLM call
+      - "raw":       use it unchanged
+    """
+    if not chat_history or mode == "raw":
+        return question
+    if mode == "heuristic":
+        return heuristic_rewrite(question, chat_history)
+    with span("chat.condense"):
+        condensed = await chain.question_generator.ainvoke(
+            {"question": question, "chat_history": format_chat_history(chat_history)},
+            config={"callbacks": callbacks or []},
+        )
+    return condensed.get("text", question)
+
+async def build_rag_messages(
+    chain: ConversationalRetrievalChain,
+    question: str,
+    chat_history: List[Dict[str, Any]],
+    mode: str,
+    callbacks: Optional[List[BaseCallbackHandler]] = None,
+    context_report: Optional[Dict[str, Any]] = None,
+) -> List[BaseMessage]:
+    """
+    Resolve the question, retrieve context and format the generation prompt.
+    With CONTEXT_PACKING_ENABLED the retrieved chunks are deduplicated,
+    merged and fitted to the token budget (see context_packing); the
+    packing report is copied into `context_report` if given.
+    """
+    standalone = await resolve_question(chain, question, chat_history, mode, callbacks)
+    with span("chat.retrieve"):
+        if settings.context_packing_enabled:
+            context, report = await pack_retrieved_context(
+                chain.retriever.vectorstore,
+                standalone,
+                chain.retriever.search_kwargs.get("k", 5),
+                lexical=getattr(chain.retriever, "lexical_index", None),
+            )
+            if context_report is not None:
+                context_report.update(report)
+        else:
+            docs = await chain.retriever.ainvoke(standalone)
+            context = "\n\n".join(d.page_content for d in docs)
+    return user_prompt.format_messages(context=context, question=standalone)
+
+def get_chain_llm(chain: ConversationalRetrievalChain):
+    return chain.combine_docs_chain.llm_chain.llm
+
+async def answer_rag_question(
+    chain: ConversationalRetrievalChain,
+    question: str,
+    chat_history: List[Dict[str, Any]],
+    mode: Optional[str] = None,
+    callbacks: Optional[List[BaseCallbackHandler]] = None,
+    context_report: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Answer `question` with the steps of `chain`, making one generation call
+    plus one condensing call only in "condense" mode with non-empty history.
+    """
+    mode = mode or settings.chat_pipeline_mode
+    messages = await build_rag_messages(chain, question, chat_history, mode, callbacks, context_report)
+    with span("chat.generate"):
+        result = await get_chain_llm(chain).ainvoke(messages, config={"callbacks": callbacks or []})
+    return getattr(result, "content", result)
+
+async def stream_rag_answer(
+    chain: ConversationalRetrievalChain,
+    question: str,
+    chat_history: List[Dict[str, Any]],
+    mode: Optional[str] = None,
+    callbacks: Optional[List[BaseCallbackHandler]] = None,
+    context_report: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """
+    Same as answer_rag_question, but yields answer tokens from the LLM as
+    they arrive.
+    """
+    mode = mode or settings.chat_pipeline_mode
+    messages = await build_rag_messages(chain, question, chat_history, mode, callbacks, context_report)
+    started = time.perf_counter()
+    first_token = True
+    async for chunk in get_chain_llm(chain).astream(messages, config={"callbacks": callbacks or []}):
+        token = getattr(chunk, "content", chunk)
+        if token:
+            if first_token:
+                record("chat.first_token", time.perf_counter() - started)
+                first_token = False
+            yield token
+    record("chat.generate", time.perf_counter() - started)
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+
+from config import settings
+from logging_config import logger
+
+# ──────────────────────────────────────────────────────────────────────────────
+# In-process LRU cache of loaded per-user FAISS vectorstores
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def estimate_vectorstore_bytes(vectorstore: FAISS) -> int:
+    """
+    Rough in-memory size of a loaded vectorstore: the raw float32 vectors plus
+    the docstore, as reported by its `nbytes` (MmapChunkStore) or else the
+    UTF-8 text held in an in-memory docstore.
+    """
+    index = vectorstore.index
+    size = int(index.ntotal) * int(index.d) * 4
+    nbytes = getattr(vectorstore.docstore, "nbytes", None)
+    if nbytes is not None:
+        return size + nbytes
+    docs = getattr(vectorstore.docstore, "_dict", {})
+    for doc in docs.values():
+        size += len(getattr(doc, "page_content", "").encode("utf-8"))
+    return size
+
+
+def close_vectorstore(vectorstore: FAISS) -> None:
+    """Release the files held open by the vectorstore's docstore (the memory-mapped chunk store)."""
+    close = getattr(vectorstore.docstore, "close", None)
+    if close is not None:
+        close()
+
+
+class VectorstoreCache:
+    """
+    Bounded LRU cache of loaded vectorstores keyed by user_id.
+
+    The cache is limited both by entry count and by an approximate memory
+    budget. Entries are replaced atomically under a lock, so a reader either
+    sees the old index or the new one, never a half-written one. Each entry
+    records the index generation it was loaded from; asking for another
+    generation is a miss. Evicted or replaced vectorstores are closed once
+    they have been out of the cache for `close_grace_seconds`, so requests
+    still searching them are not cut off.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, close_grace_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.close_grace_seconds = close_grace_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._retired: Deque[Tuple[float, FAISS]] = deque()
+        self._lock = threading.RLock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: str, generation: Optional[int] = None) -> Optional[FAISS]:
+        """
+        Return the cached vectorstore for user_id, or None on a miss. With
+        `generation`, an entry loaded from a different generation is a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or (generation is not None and entry[2] != generation):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def get_or_load(
+        self, user_id: str, loader: Callable[[], FAISS], generation: Optional[int] = None
+    ) -> FAISS:
+        """
+        Return the cached vectorstore for user_id (of `generation`, if given),
+        calling `loader` and caching its result on a miss.
+        """
+        vectorstore = self.get(user_id, generation)
+        if vectorstore is not None:
+            return vectorstore
+        vectorstore = loader()
+        self.put(user_id, vectorstore, generation)
+        return vectorstore
+
+    def put(self, user_id: str, vectorstore: FAISS, generation: Optional[int] = None) -> None:
+        """Insert or swap the vectorstore for user_id, evicting LRU entries as needed."""
+        size = estimate_vectorstore_bytes(vectorstore)
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+                if old[0] is not vectorstore:
+                    self._retire(old[0])
+            self._close_retired()
+            if self.max_entries <= 0 or size > self.max_bytes:
+                logger.info("Vectorstore for %s (%d bytes) not cached", user_id, size)
+                return
+            self._entries[user_id] = (vectorstore, size, generation)
+            self._total_bytes += size
+            self._evict()
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop the cached vectorstore for user_id (if any)."""
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+                self._retire(old[0])
+            self._close_retired()
+
+    def clear(self) -> None:
+        with self._lock:
+            for vectorstore, _, _ in self._entries.values():
+                self._retire(vectorstore)
+            self._entries.clear()
+            self._total_bytes = 0
+            self._close_retired()
+
+    def _retire(self, vectorstore: FAISS) -> None:
+        self._retired.append((time.monotonic(), vectorstore))
+
+    def _close_retired(self) -> None:
+        cutoff = time.monotonic() - self.close_grace_seconds
+        while self._retired and self._retired[0][0] <= cutoff:
+            _, vectorstore = self._retired.popleft()
+            close_vectorstore(vectorstore)
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            user_id, (vectorstore, size, _) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._retire(vectorstore)
+            self.evictions += 1
+            logger.info("Evicted vectorstore for %s from cache", user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "retired_open": len(self._retired),
+            }
+
+
+# Single shared cache instance
+vectorstore_cache = VectorstoreCache(
+    max_entries=settings.vectorstore_cache_max_entries,
+    max_bytes=settings.vectorstore_cache_max_bytes,
+    close_grace_seconds=settings.vectorstore_close_grace_seconds,
+)